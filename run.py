@@ -1,9 +1,9 @@
-from PyQt5.QtWidgets import QApplication
-
-from src.gui import MainWindow
+if __name__ == '__main__':
+    # Qt is imported here only, Held-Karp worker processes import this file again
+    from PyQt5.QtWidgets import QApplication
 
+    from src.gui import MainWindow
 
-if __name__ == '__main__':
     app = QApplication([])
     gui = MainWindow()
     gui.show()
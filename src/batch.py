@@ -0,0 +1,178 @@
+'''
+Solve many route jobs against one saved route file without the GUI.
+
+Jobs are read as JSON lines:
+    {"id": "a", "start": 12, "end": [350.5, 80], "targets": [4, [120, 44]]}
+Terminals are node indexes of the route file or [x, y] points that are snapped
+to the closest route node. "mode" and "search" (point-to-point search method
+between terminals, see Graph.shortest_path) are optional per job. Results are
+written in the same order as JSON lines:
+    {"id": "a", "distance": 812.3, "route": [12, 13, ...]}
+or {"id": "a", "error": "..."} for jobs that could not be solved.
+'''
+# Standard
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+
+# Local
+from .node_file import load_nodes_from_file
+from .path_utils.graph import Graph, SEARCH_METHODS
+from .path_utils.contraction import ContractionHierarchy, hierarchy_path
+from .path_utils.distance_cache import DistanceCache, distance_cache_path
+from .path_utils.path_manager import PathManager
+
+MODES = ['auto', 'dijkstra', 'tsp']
+# auto: one search per terminal finds all the others
+SEARCHES = ['auto'] + SEARCH_METHODS
+# Jobs sent to a worker at a time
+CHUNK_SIZE = 4
+
+# Graph and distance cache loaded once per process
+_worker_state = {}
+
+
+def load_graph(node_path):
+    '''
+    Graph of a saved .npz or .json route file, with the contraction hierarchy
+    saved next to it if there is one and it still matches
+    '''
+    if node_path.lower().endswith('.npz'):
+        import numpy as np
+        with np.load(node_path) as data:
+            splits = data['splits'] if 'splits' in data.files else ()
+            graph = Graph.from_csr(data['coords'], data['offsets'], data['neighbours'], splits)
+    else:
+        nodes = load_nodes_from_file(node_path)
+        if nodes is None:
+            raise ValueError(f'Not a route file: {node_path}')
+        graph = Graph.from_route_nodes(nodes)
+    ch_path = hierarchy_path(node_path)
+    if os.path.exists(ch_path):
+        graph.attach_hierarchy(ContractionHierarchy.load(ch_path))
+    return graph
+
+
+def load_state(node_path, default_mode='auto', default_search='auto'):
+    '''Graph and distance cache of a route file, shared by every job solved on it'''
+    cache_path = distance_cache_path(node_path)
+    cache = DistanceCache.load(cache_path) if os.path.exists(cache_path) \
+        else DistanceCache()
+    return {
+        'graph': load_graph(node_path),
+        'cache': cache,
+        'mode': default_mode,
+        'search': default_search,
+        'coords': None
+    }
+
+
+def init_worker(node_path, default_mode, default_search='auto'):
+    _worker_state.update(load_state(node_path, default_mode, default_search))
+
+
+def resolve_terminal(state, terminal):
+    '''Node index of a terminal given as node index or [x, y] point'''
+    graph = state['graph']
+    # JSON true and false come in as bool, which is an int too
+    if isinstance(terminal, bool):
+        raise TypeError(f'Terminal must be a node index or [x, y], not {terminal}')
+    if isinstance(terminal, int):
+        if not 0 <= terminal < len(graph.coords):
+            raise ValueError(f'No node {terminal}')
+        return terminal
+    x, y = terminal
+    if state['coords'] is None:
+        import numpy as np
+        # Zero-copy views of the graph coordinate arrays
+        state['coords'] = (np.frombuffer(graph.xs), np.frombuffer(graph.ys))
+    xs, ys = state['coords']
+    return int(((xs - x) ** 2 + (ys - y) ** 2).argmin())
+
+
+def solve(state, job):
+    '''Solve one job dict on a loaded route file, returns the result dict'''
+    if not isinstance(job, dict):
+        return {'id': None, 'error': 'TypeError: Job must be a JSON object'}
+    job_id = job.get('id')
+    try:
+        start = resolve_terminal(state, job['start'])
+        end = resolve_terminal(state, job['end'])
+        targets = [resolve_terminal(state, t) for t in job['targets']]
+        if not targets:
+            raise ValueError('Zero targets set')
+        mode = job.get('mode', state['mode'])
+        if mode not in MODES:
+            raise ValueError(f'Unknown mode: {mode}')
+        search = job.get('search', state['search'])
+        if search not in SEARCHES:
+            raise ValueError(f'Unknown search: {search}')
+
+        from .path_utils.held_karp import MAX_TARGETS
+        if mode == 'auto':
+            mode = 'dijkstra' if len(targets) <= MAX_TARGETS else 'tsp'
+        elif mode == 'dijkstra' and len(targets) > MAX_TARGETS:
+            raise ValueError(f'Absolute shortest supports up to {MAX_TARGETS} targets')
+
+        # Jobs already run in parallel, Held-Karp stays in this process
+        path_manager = PathManager(state['graph'], start, end, targets,
+                                   cache=state['cache'], processes=1,
+                                   search=None if search == 'auto' else search)
+        # Raises ValueError if the terminals are not all connected
+        distance, route = path_manager.get_shortest_route(mode)
+        return {'id': job_id, 'distance': distance, 'route': route}
+    except (ValueError, KeyError, TypeError, IndexError) as err:
+        return {'id': job_id, 'error': f'{type(err).__name__}: {err}'}
+
+
+def solve_job(line):
+    '''Solve one JSON line job, returns the result line'''
+    try:
+        job = json.loads(line)
+    except ValueError as err:
+        return json.dumps({'id': None, 'error': f'{type(err).__name__}: {err}'})
+    return json.dumps(solve(_worker_state, job))
+
+
+def solve_jobs(node_path, lines, mode='auto', processes=1, search='auto'):
+    '''Yields result lines for job lines in the same order'''
+    lines = (line for line in lines if line.strip())
+    if processes <= 1:
+        init_worker(node_path, mode, search)
+        yield from map(solve_job, lines)
+        return
+
+    # Spawn like Held-Karp does, forking a process with threads is not safe
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(processes, initializer=init_worker,
+                      initargs=(node_path, mode, search)) as pool:
+        yield from pool.imap(solve_job, lines, CHUNK_SIZE)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Solve route jobs from JSON lines')
+    parser.add_argument('nodes', help='saved route file (.npz or .json)')
+    parser.add_argument('jobs', nargs='?', default='-',
+                        help='jobs as JSON lines, - for stdin (default)')
+    parser.add_argument('-o', '--output', default='-',
+                        help='file for result JSON lines, - for stdout (default)')
+    parser.add_argument('-m', '--mode', choices=MODES, default='auto',
+                        help='auto: exact up to the Held-Karp limit, tsp above it')
+    parser.add_argument('-s', '--search', choices=SEARCHES, default='auto',
+                        help='point-to-point search between terminals, auto: '
+                             'one search per terminal finds all the others')
+    parser.add_argument('-p', '--processes', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args(argv)
+
+    jobs = sys.stdin if args.jobs == '-' else open(args.jobs, 'r')
+    output = sys.stdout if args.output == '-' else open(args.output, 'w')
+    try:
+        for result in solve_jobs(args.nodes, jobs, args.mode, args.processes,
+                                 args.search):
+            output.write(result + '\n')
+    finally:
+        for stream in jobs, output:
+            if stream not in (sys.stdin, sys.stdout):
+                stream.close()
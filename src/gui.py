@@ -7,7 +7,9 @@ from PyQt5 import QtWidgets
 # Local
 from .widgets.canvas import Canvas
 from .widgets.item_list import ItemList
-from .node_file import save_nodes_to_file, load_nodes_from_file
+from .node_file import save_nodes_to_file, load_nodes_from_file, node_file_path
+from .path_utils.contraction import ContractionHierarchy, hierarchy_path
+from .path_utils.distance_cache import DistanceCache, distance_cache_path
 
 
 class MainWindow(QtWidgets.QMainWindow):
@@ -19,9 +21,12 @@ class MainWindow(QtWidgets.QMainWindow):
         self.init_layout()
         self.init_menus()
         self.canvas.new_target_signal.connect(self.add_target_to_list)
+        self.canvas.new_targets_signal.connect(self.item_list.new_targets)
         self.canvas.del_target_signal.connect(self.remove_target_from_list)
         self.canvas.info_signal.connect(self.display_message)
         self.canvas.toggle_menu_signal.connect(self.toggle_menu_buttons)
+        self.canvas.path_found_signal.connect(self.item_list.arrange_items)
+        self.canvas.hierarchy_signal.connect(self.hierarchy_built)
 
     def init_layout(self):
         '''
@@ -58,6 +63,21 @@ class MainWindow(QtWidgets.QMainWindow):
         self.save_action.triggered.connect(self.save_to_file)
         self.save_action.setEnabled(False)
 
+        # Export nodes as json for other tools
+        self.export_action = QtWidgets.QAction('Export nodes as JSON', self)
+        self.export_action.triggered.connect(lambda: self.save_to_file(binary=False))
+        self.export_action.setEnabled(False)
+
+        # Save nodes with contraction hierarchy for faster repeated queries
+        self.hierarchy_action = QtWidgets.QAction('Save nodes + hierarchy', self)
+        self.hierarchy_action.triggered.connect(self.save_with_hierarchy)
+        self.hierarchy_action.setEnabled(False)
+
+        # Import targets
+        self.target_import_action = QtWidgets.QAction('Import targets', self)
+        self.target_import_action.triggered.connect(self.import_targets)
+        self.target_import_action.setEnabled(False)
+
         # Clear all
         clear_action = QtWidgets.QAction('Clear all nodes', self)
         clear_action.triggered.connect(self.canvas.clear_all_nodes)
@@ -69,6 +89,9 @@ class MainWindow(QtWidgets.QMainWindow):
         tsp_action = QtWidgets.QAction('Approximate', self)
         tsp_action.triggered.connect(lambda: self.calculate_path('tsp'))
 
+        anytime_action = QtWidgets.QAction('Best within time limit', self)
+        anytime_action.triggered.connect(self.calculate_path_anytime)
+
         # Mode actions
         self.route_action = QtWidgets.QAction('Edit route', self)
         self.route_action.triggered.connect(lambda: self.set_mode('route_edit'))
@@ -83,7 +106,8 @@ class MainWindow(QtWidgets.QMainWindow):
         mb = self.menuBar()
 
         filemenu = mb.addMenu('File')
-        for item in [load_action, self.save_action, self.node_load_action,
+        for item in [load_action, self.save_action, self.export_action,
+                     self.hierarchy_action, self.node_load_action, self.target_import_action,
                      clear_action, exit_action]:
             filemenu.addAction(item)
 
@@ -93,7 +117,7 @@ class MainWindow(QtWidgets.QMainWindow):
 
         self.path_menu = mb.addMenu('Calculate path')
         self.path_menu.setEnabled(False)
-        for item in [dijkstra_action, tsp_action]:
+        for item in [dijkstra_action, tsp_action, anytime_action]:
             self.path_menu.addAction(item)
 
     def set_mode(self, mode):
@@ -131,16 +155,24 @@ class MainWindow(QtWidgets.QMainWindow):
             return
 
         self.save_action.setEnabled(True)
+        self.export_action.setEnabled(True)
+        self.hierarchy_action.setEnabled(True)
         self.node_load_action.setEnabled(True)
+        self.target_import_action.setEnabled(True)
         self.img_file = img_path
         self.canvas.new_image(img_path)
-        img_x = self.canvas.image.width()
-        img_y = self.canvas.image.height()
+        # Large maps open in a screen sized window
+        screen = QtWidgets.QApplication.desktop().availableGeometry(self)
+        img_x = min(self.canvas.image.width(), screen.width() - self.canvas.x())
+        img_y = min(self.canvas.image.height(), screen.height() - self.canvas.y())
         self.resize(self.canvas.x() + img_x, self.canvas.y() + img_y)
         
-        saved_node_file = f'{os.path.splitext(img_path)[0]}.json'
-        if os.path.exists(saved_node_file):
-            self.load_from_file(saved_node_file)
+        # Binary file is preferred, json is only there for older saves
+        for binary in (True, False):
+            saved_node_file = node_file_path(img_path, binary)
+            if os.path.exists(saved_node_file):
+                self.load_from_file(saved_node_file)
+                break
 
     def add_target_to_list(self, obj):
         self.item_list.new_target(obj)
@@ -156,26 +188,67 @@ class MainWindow(QtWidgets.QMainWindow):
         mb.setStandardButtons(QtWidgets.QMessageBox.Ok)
         mb.exec_()
 
-    def calculate_path(self, algo):
-        self.canvas.calculate_path(algo)
-        found_path = self.canvas.shortest_path
-        if found_path:
-            self.item_list.arrange_items(found_path)
+    def calculate_path(self, algo, budget=None):
+        self.canvas.calculate_path(algo, budget)
+
+    def calculate_path_anytime(self):
+        budget, done = QtWidgets.QInputDialog.getInt(self, 'Time limit',
+                                                     'Search time (seconds):', 10, 1, 3600)
+        if not done:
+            return
+        self.calculate_path('anytime', budget)
 
-    def save_to_file(self):
+    def save_to_file(self, binary=True):
         route_nodes = self.canvas.route_nodes
-        save_nodes_to_file(self.img_file, route_nodes)
+        save_nodes_to_file(self.img_file, route_nodes, binary)
+        self.canvas.distance_cache.save(distance_cache_path(self.img_file))
         self.display_message(f'Nodes saved!')
 
-    def load_from_file(self, json_path=None):
-        if not json_path:
+    def save_with_hierarchy(self):
+        '''
+        Save nodes and build contraction hierarchy for them in the background, it is
+        saved in hierarchy_built. Hierarchy is only used as long as the route graph
+        stays the same as when it was built.
+        '''
+        route_nodes = self.canvas.route_nodes
+        if not route_nodes:
+            self.display_message('Draw route first')
+            return
+        save_nodes_to_file(self.img_file, route_nodes)
+        self.canvas.distance_cache.save(distance_cache_path(self.img_file))
+        self.canvas.build_hierarchy()
+
+    def hierarchy_built(self, hierarchy):
+        hierarchy.save(hierarchy_path(self.img_file))
+        self.display_message(f'Nodes and hierarchy saved!')
+
+    def load_from_file(self, node_path=None):
+        if not node_path:
             dialog = QtWidgets.QFileDialog(self)
-            json_path, _ = dialog.getOpenFileName(self, "Load nodes", "")
-            if not os.path.exists(json_path):
+            node_path, _ = dialog.getOpenFileName(self, "Load nodes", "",
+                                                  "Nodes (*.npz *.json)")
+            if not os.path.exists(node_path):
                 return
         try:
-            loaded_nodes = load_nodes_from_file(json_path)
+            loaded_nodes = load_nodes_from_file(node_path)
             self.canvas.clear_all_nodes()
-            self.canvas.route_nodes = loaded_nodes
+            self.canvas.load_route_nodes(loaded_nodes)
+            ch_path = hierarchy_path(node_path)
+            if os.path.exists(ch_path):
+                self.canvas.hierarchy = ContractionHierarchy.load(ch_path)
+            cache_path = distance_cache_path(node_path)
+            if os.path.exists(cache_path):
+                self.canvas.distance_cache = DistanceCache.load(cache_path)
         except Exception as err:
             self.display_message(f'Could not load nodes: {err}')
+
+    def import_targets(self):
+        dialog = QtWidgets.QFileDialog(self)
+        path, _ = dialog.getOpenFileName(self, "Import targets", "",
+                                         "Targets (*.csv *.json)")
+        if not os.path.exists(path):
+            return
+        try:
+            self.canvas.import_targets(path)
+        except Exception as err:
+            self.display_message(f'Could not import targets: {err}')
@@ -1,72 +1,102 @@
 # Standard
+import csv
 import math
 import json
 import os
 
-# 3rd party
-from PyQt5.QtWidgets import QListWidgetItem
-
 
 class RouteNode:
-    def __init__(self, x, y, color):
+    # No per node __dict__, large routes have hundreds of thousands of these.
+    # Follow-up: only the solvers use the compact Graph arrays, built from these
+    # nodes in the worker. The editor still keeps an object per node, about 170
+    # bytes with the coordinate floats and the connects_with list, and
+    # EdgeRegistry, NodeGrid, SegmentGrid and ShortestPathForest add dicts keyed
+    # by these objects. save_nodes_to_file builds its arrays from them too.
+    # Getting the editor down needs array-backed handles in place of these
+    # objects, with the registry, grids and forest keyed by index.
+    __slots__ = ('x', 'y', 'connects_with', 'color', 'pairing', 'split')
+    # Screen pixels
+    reach_radius = 10
+
+    def __init__(self, x, y, color, split=False):
         self.x = x
         self.y = y
         self.connects_with = []
         self.color = color
         self.pairing = False
-        self.reach_radius = 10
+        # Node was placed only to split a segment for a target
+        self.split = split
 
-    def within_reach(self, mpos):
-        return points_distance((self.x, self.y), mpos) <= self.reach_radius
 
+class EdgeRegistry:
+    '''
+    Unique undirected connections between route nodes with cached lengths.
+    Adding, removing and looking up a connection is O(1), so neither drawing nor
+    solving has to strip (A, B), (B, A) duplicates from connects_with lists.
+    '''
+    def __init__(self, route_nodes=()):
+        self.lengths = {}
+        self.reset(route_nodes)
 
-class TargetNode(QListWidgetItem):
-    def __init__(self, num, text, mx, my, parent_node):
-        super().__init__()
-        self.num = num
-        self.text = text
-        self.draw_x = mx
-        self.draw_y = my
-        self.parent_node = parent_node
-        self.update_text()
+    @staticmethod
+    def key(n1, n2):
+        return (n1, n2) if id(n1) < id(n2) else (n2, n1)
 
-    def update_text(self):
-        self.setText(f'[{self.num}] {self.text}')
+    def reset(self, route_nodes):
+        '''Rebuild registry from connects_with lists of given nodes'''
+        self.lengths = {}
+        for node in route_nodes:
+            for connection in node.connects_with:
+                self.add(node, connection)
 
+    def add(self, n1, n2):
+        self.lengths[self.key(n1, n2)] = points_distance((n1.x, n1.y), (n2.x, n2.y))
 
-def closest_segment_point(point, route_pairs):
-    '''https://stackoverflow.com/questions/27161533/find-the-shortest-distance-between-a-point-and-line-segments-not-line
+    def remove(self, n1, n2):
+        self.lengths.pop(self.key(n1, n2), None)
 
-    This function is used to draw line between target's actual position on the route
-    and graphic that shows target number (where user clicked).
-    '''
-    closest_point = None
-    dist_to_closest = math.inf
-    pair = None
+    def remove_node(self, node):
+        for connection in node.connects_with:
+            self.remove(node, connection)
+
+    def update_node(self, node):
+        '''Refresh cached lengths after node has moved'''
+        for connection in node.connects_with:
+            self.add(node, connection)
+
+    def length(self, n1, n2):
+        return self.lengths[self.key(n1, n2)]
+
+    def __contains__(self, pair):
+        return self.key(*pair) in self.lengths
 
-    for segment in route_pairs:
-        node_a, node_b = segment[0], segment[1]
-        dx = node_b.x - node_a.x
-        dy = node_b.y - node_a.y
-        dr2 = float(dx ** 2 + dy ** 2) + 0.0000001
+    def __iter__(self):
+        return iter(self.lengths)
 
-        lerp = ((point[0] - node_a.x) * dx + (point[1] - node_a.y) * dy) / dr2
+    def __len__(self):
+        return len(self.lengths)
 
-        if lerp <= 0:
-            lerp = 0
-        elif lerp >= 1:
-            lerp = 1
+    def items(self):
+        '''[((node, node), length), ...]'''
+        return self.lengths.items()
 
-        x = lerp * dx + node_a.x
-        y = lerp * dy + node_a.y
 
-        dist = points_distance((x, y), point)
-        if dist < dist_to_closest:
-            dist_to_closest = dist
-            closest_point = (int(x), int(y))
-            pair = segment
+def project_to_segment(point, node_a, node_b):
+    '''Returns closest point on segment between nodes to given point and distance to it'''
+    dx = node_b.x - node_a.x
+    dy = node_b.y - node_a.y
+    dr2 = float(dx ** 2 + dy ** 2) + 0.0000001
 
-    return closest_point, pair
+    lerp = ((point[0] - node_a.x) * dx + (point[1] - node_a.y) * dy) / dr2
+
+    if lerp <= 0:
+        lerp = 0
+    elif lerp >= 1:
+        lerp = 1
+
+    x = lerp * dx + node_a.x
+    y = lerp * dy + node_a.y
+    return (x, y), points_distance((x, y), point)
 
 
 def points_distance(p1, p2):
@@ -74,31 +104,95 @@ def points_distance(p1, p2):
     return math.sqrt((p2[0] - p1[0]) ** 2 + (p2[1] - p1[1]) ** 2)
 
 
-def save_nodes_to_file(file_path, route_nodes):
+def node_file_path(file_path, binary=True):
+    '''Nodes are saved next to the image as <name>.npz, or <name>.json'''
+    return f'{os.path.splitext(file_path)[0]}.{"npz" if binary else "json"}'
+
+
+def nodes_to_csr(route_nodes):
+    '''
+    Compressed sparse rows of the route: coords (N x 2 floats) and neighbours of
+    node i in neighbours[offsets[i]:offsets[i+1]]
+    '''
+    # numpy only for binary files, importing the route model stays fast without it
+    import numpy as np
+    index = {node: i for i, node in enumerate(route_nodes)}
+    coords = np.array([(node.x, node.y) for node in route_nodes],
+                      dtype=np.float64).reshape(-1, 2)
+    degrees = np.fromiter((len(node.connects_with) for node in route_nodes),
+                          dtype=np.int64, count=len(route_nodes))
+    offsets = np.zeros(len(route_nodes) + 1, dtype=np.int64)
+    np.cumsum(degrees, out=offsets[1:])
+    neighbours = np.fromiter((index[c] for node in route_nodes for c in node.connects_with),
+                             dtype=np.int64, count=int(offsets[-1]))
+    return coords, offsets, neighbours
+
+
+def nodes_from_csr(coords, offsets, neighbours, splits=()):
+    '''RouteNodes from arrays made by nodes_to_csr, splits are indexes of split nodes'''
+    node_objects = [RouteNode(x, y, (0, 0, 255)) for x, y in coords.tolist()]
+    for i in splits:
+        node_objects[i].split = True
+    neighbours = neighbours.tolist()
+    offsets = offsets.tolist()
+    for i, node_obj in enumerate(node_objects):
+        node_obj.connects_with.extend(
+            [node_objects[c] for c in neighbours[offsets[i]:offsets[i+1]]])
+    return node_objects
+
+
+def save_nodes_to_file(file_path, route_nodes, binary=True):
+    '''
+    Save route next to file_path. Binary .npz stores the route as CSR arrays and
+    is the fast default, .json is kept for exporting. Both record which nodes
+    only split a segment for a target.
+    '''
+    if binary:
+        import numpy as np
+        coords, offsets, neighbours = nodes_to_csr(route_nodes)
+        splits = np.array([i for i, node in enumerate(route_nodes) if node.split],
+                          dtype=np.int64)
+        with open(node_file_path(file_path), 'wb') as npz_file:
+            np.savez(npz_file, coords=coords, offsets=offsets, neighbours=neighbours,
+                     splits=splits)
+        return
+
+    index = {node: i for i, node in enumerate(route_nodes)}
     node_dict = {}
     for i, node in enumerate(route_nodes):
-        node_connections = [route_nodes.index(c) for c in node.connects_with]
+        node_connections = [index[c] for c in node.connects_with]
         node_dict[i] = {
             'coords': (node.x, node.y),
             'connects_with': node_connections
         }
+        if node.split:
+            node_dict[i]['split'] = True
 
-    json_path = f'{os.path.splitext(file_path)[0]}.json'
+    json_path = node_file_path(file_path, binary=False)
     with open(json_path, 'w', encoding='utf-8') as json_file:
         json.dump(node_dict, json_file, indent=2)
 
-def load_nodes_from_file(path_to_json):
-    if not path_to_json.lower().endswith('.json'):
+def load_nodes_from_file(path):
+    '''Load route from .npz or .json file, format is picked by extension'''
+    if path.lower().endswith('.npz'):
+        import numpy as np
+        with np.load(path) as data:
+            # Files saved before split nodes were recorded have none
+            splits = data['splits'] if 'splits' in data.files else ()
+            return nodes_from_csr(data['coords'], data['offsets'], data['neighbours'],
+                                  splits)
+
+    if not path.lower().endswith('.json'):
         return
 
-    with open(path_to_json, 'r') as node_json:
+    with open(path, 'r') as node_json:
         node_dict = json.load(node_json)
 
     # Create node-objects
     node_objects = []
     for i, node in node_dict.items():
         x, y = node['coords']
-        new_node = RouteNode(x, y, (0, 0, 255))
+        new_node = RouteNode(x, y, (0, 0, 255), node.get('split', False))
         node_objects.append(new_node)
 
     # Add connections
@@ -107,3 +201,26 @@ def load_nodes_from_file(path_to_json):
         node_obj.connects_with.extend([node_objects[i] for i in c_indexes])
     
     return node_objects
+
+
+def load_targets_from_file(path):
+    '''
+    Read targets from .csv rows "name,x,y" (header row is optional) or from .json
+    list of {"name": .., "x": .., "y": ..} objects or [name, x, y] lists.
+    Returns [(name, x, y), ...]
+    '''
+    if path.lower().endswith('.json'):
+        with open(path, 'r') as target_json:
+            rows = json.load(target_json)
+        rows = [(r['name'], r['x'], r['y']) if isinstance(r, dict) else r for r in rows]
+    else:
+        with open(path, 'r', newline='') as target_csv:
+            rows = [r for r in csv.reader(target_csv) if r]
+        # Skip header
+        if rows and rows[0][1].strip().lower() == 'x':
+            rows = rows[1:]
+
+    targets = []
+    for name, x, y in rows:
+        targets.append((str(name).strip(), float(x), float(y)))
+    return targets
@@ -0,0 +1,214 @@
+# Standard
+from array import array
+
+# Local
+from .graph import Graph
+from .dijkstra import dijkstra_seeded
+
+# Chains are only collapsed if at least this fraction of the nodes has degree 2
+MIN_DEGREE_TWO_FRACTION = 0.5
+
+
+def collapsible(graph):
+    '''Enough degree-2 nodes that collapsing chains makes the graph much smaller'''
+    offsets = graph.offsets
+    size = len(offsets) - 1
+    degree_two = sum(1 for v in range(size) if offsets[v + 1] - offsets[v] == 2)
+    return degree_two >= size * MIN_DEGREE_TWO_FRACTION
+
+
+class ChainGraph:
+    '''
+    Graph with chains of degree-2 nodes collapsed into single weighted edges.
+    Traced routes are mostly such chains that only bend the line, so the
+    contracted graph is a fraction of the original size.
+
+    Graph is contracted once and reused for any terminals. Queries take and return
+    node indexes of the original graph: a terminal inside a chain starts or ends
+    the search at both ends of its chain, found paths are expanded back to every
+    node of the chains they pass.
+
+    fingerprint is the Graph.fingerprint() of the graph it was built from.
+    With nodes only those degree-2 nodes are collapsed, e.g. the ones splitting
+    segments for targets. If the graph has a hierarchy attached, queries use it.
+    '''
+    def __init__(self, graph, nodes=None):
+        self.fingerprint = graph.fingerprint()
+        self.coords = graph.coords
+        adjacency = graph.adjacency
+        size = len(adjacency)
+        neighbours = [list(adjacency[v]) for v in range(size)]
+        interior = [len(neighbours[v]) == 2 and neighbours[v][0][1] != neighbours[v][1][1]
+                    for v in range(size)]
+        self.splits = None if nodes is None else frozenset(nodes)
+        if nodes is not None:
+            interior = [is_interior and v in self.splits
+                        for v, is_interior in enumerate(interior)]
+
+        # chains[c] = (nodes from end to end, distance from first node to each node)
+        self.chains = []
+        # Chain and position in it of every interior node, -1 for kept nodes
+        self.chain_of = array('q', [-1]) * size
+        self.position = array('q', [0]) * size
+        # Shortest chain between kept nodes u < w
+        best = {}
+
+        def walk(u):
+            for distance, w in neighbours[u]:
+                # Chain was already walked from its other end
+                if interior[w] and self.chain_of[w] != -1:
+                    continue
+                nodes, distances = [u], [0]
+                while interior[w]:
+                    nodes.append(w)
+                    distances.append(distance)
+                    (c1, n1), (c2, n2) = neighbours[w]
+                    step, next_ = (c2, n2) if n1 == nodes[-2] else (c1, n1)
+                    w = next_
+                    distance += step
+                nodes.append(w)
+                distances.append(distance)
+                # Direct connections are seen from both ends, keep them once
+                if len(nodes) == 2 and u >= w:
+                    continue
+                c = len(self.chains)
+                self.chains.append((nodes, distances))
+                for i in range(1, len(nodes) - 1):
+                    self.chain_of[nodes[i]] = c
+                    self.position[nodes[i]] = i
+                if u != w:
+                    key = (u, w) if u < w else (w, u)
+                    if key not in best or distance < self.chains[best[key]][1][-1]:
+                        best[key] = c
+
+        for u in range(size):
+            if not interior[u]:
+                walk(u)
+        # Rings of degree-2 nodes have no end, one of their nodes is kept instead
+        for u in range(size):
+            if interior[u] and self.chain_of[u] == -1:
+                interior[u] = False
+                walk(u)
+
+        self.kept = [v for v in range(size) if not interior[v]]
+        self.index = {v: i for i, v in enumerate(self.kept)}
+        self.best = best
+        connections = [(self.index[u], self.index[w], self.chains[c][1][-1])
+                       for (u, w), c in best.items()]
+        self.graph = Graph([graph.coords[v] for v in self.kept], connections)
+        self.counter = self.graph.counter
+
+    def __len__(self):
+        return len(self.kept)
+
+    def ends(self, v):
+        '''[(distance, kept node, path from v to it)] for the closest kept nodes of v'''
+        c = self.chain_of[v]
+        if c == -1:
+            return [(0, v, (v, ))]
+        nodes, distances = self.chains[c]
+        i = self.position[v]
+        return [(distances[i], nodes[0], tuple(nodes[i::-1])),
+                (distances[-1] - distances[i], nodes[-1], tuple(nodes[i:]))]
+
+    def chain(self, a, b):
+        '''(nodes, distances) of the chain between contracted nodes a and b'''
+        u, w = self.kept[a], self.kept[b]
+        return self.chains[self.best[(u, w) if u < w else (w, u)]]
+
+    def expand(self, path):
+        '''Contracted path to original node indexes'''
+        expanded = [self.kept[path[0]]]
+        for a, b in zip(path[:-1], path[1:]):
+            nodes = self.chain(a, b)[0]
+            expanded.extend(nodes[1:] if nodes[0] == self.kept[a] else nodes[-2::-1])
+        return expanded
+
+    def terminal_key(self, v):
+        '''
+        (a, b, x, y) naming node v by its place in the contracted graph: a <= b are
+        the contracted nodes at the ends of its chain (a == b for a kept node) and
+        x, y its coordinates. Stays the same when other chains are split.
+        '''
+        c = self.chain_of[v]
+        if c == -1:
+            a = b = self.index[v]
+        else:
+            nodes = self.chains[c][0]
+            a, b = sorted((self.index[nodes[0]], self.index[nodes[-1]]))
+        x, y = self.coords[v]
+        return (a, b, x, y)
+
+    def compact(self, path):
+        '''Path in original indexes to the contracted nodes it passes'''
+        return tuple(self.index[v] for v in path if self.chain_of[v] == -1)
+
+    def restore(self, f, t, compact):
+        '''
+        Path from f to t in original indexes from compact() of a shortest path
+        between them, in this graph or one with the same contracted graph
+        '''
+        if not compact:
+            # Along the chain both are on
+            nodes = self.chains[self.chain_of[f]][0]
+            i, j = self.position[f], self.position[t]
+            step = 1 if i <= j else -1
+            return tuple(nodes[i:j + step:step])
+        middle = self.expand(compact)
+        first = min((d, path) for d, u, path in self.ends(f) if u == middle[0])[1]
+        last = min((d, path) for d, u, path in self.ends(t) if u == middle[-1])[1]
+        return first[:-1] + tuple(middle) + last[-2::-1]
+
+    def length(self, path):
+        '''Length of contracted path along the chains it passes'''
+        return sum(self.chain(a, b)[1][-1] for a, b in zip(path[:-1], path[1:]))
+
+    def query(self, f, t, counter=None):
+        '''Same as ContractionHierarchy.query, (distance, path) in original indexes'''
+        return self.paths_from(f, [t], counter)[t]
+
+    def paths_from(self, f, targets, counter=None):
+        '''
+        Same as Graph.paths_from, {target: (distance, path)} in original indexes.
+        With a hierarchy every target is a query seeded from the ends of both
+        chains. Hierarchy was built with the chains as they were then, so distances
+        are measured again along the chains of this graph.
+        '''
+        counter = counter or self.counter
+        hierarchy = self.graph.hierarchy
+        starts = {}
+        for distance, u, path in self.ends(f):
+            if u not in starts or distance < starts[u][0]:
+                starts[u] = (distance, path)
+        sources = [(d, self.index[u]) for u, (d, _) in starts.items()]
+        ends = {t: self.ends(t) for t in targets}
+        if hierarchy is None:
+            wanted = {self.index[u] for t in targets for _, u, _ in ends[t]}
+            searched = dijkstra_seeded(self.graph.adjacency, sources, wanted, counter)
+
+        paths = {}
+        for t in targets:
+            best = (float('inf'), ())
+            # Both on the same chain, the way along it may be the shortest
+            if self.chain_of[f] != -1 and self.chain_of[f] == self.chain_of[t]:
+                nodes, distances = self.chains[self.chain_of[f]]
+                i, j = self.position[f], self.position[t]
+                step = 1 if i <= j else -1
+                best = (abs(distances[j] - distances[i]), tuple(nodes[i:j + step:step]))
+            if hierarchy is None:
+                found = [searched[self.index[u]] + (distance, path)
+                         for distance, u, path in ends[t] if self.index[u] in searched]
+            else:
+                _, contracted = hierarchy.query_seeded(
+                    sources, [(d, self.index[u]) for d, u, _ in ends[t]], counter)
+                found = [(starts[self.kept[contracted[0]]][0] + self.length(contracted),
+                          contracted, distance, path)
+                         for distance, u, path in ends[t]
+                         if contracted and self.index[u] == contracted[-1]]
+            for cost, contracted, distance, path in found:
+                if cost + distance < best[0]:
+                    middle = self.expand(contracted)
+                    first = starts[middle[0]][1]
+                    best = (cost + distance, first[:-1] + tuple(middle) + path[-2::-1])
+            paths[t] = best
+        return paths
@@ -0,0 +1,226 @@
+# Standard
+import heapq
+import json
+import os
+
+# Local
+from .dijkstra import build_path
+
+# Contracted nodes between progress reports and cancel checks
+PROGRESS_STEP = 256
+
+
+def hierarchy_path(file_path):
+    '''Hierarchy is saved next to the node file as <name>.ch.json'''
+    return f'{os.path.splitext(file_path)[0]}.ch.json'
+
+
+class ContractionHierarchy:
+    '''
+    Contraction hierarchy over the route graph. Nodes are contracted one by one
+    and shortcuts are added so that shortest paths are kept, every node gets a rank
+    by the contraction order. Queries only move upwards in rank from both ends and
+    shortcuts remember the node they bypass, so paths can be unpacked again.
+
+    fingerprint is the Graph.fingerprint() of the graph it was built from.
+    splits are nodes of that graph that only split a segment for a target. They
+    are left out of the hierarchy, so placing other targets later does not make it
+    out of date (see Graph.attach_hierarchy).
+    '''
+    def __init__(self, fingerprint, rank, upward, middle, splits=()):
+        self.fingerprint = fingerprint
+        self.rank = rank
+        # upward[v] = [(distance, neighbour), ...] neighbours with higher rank
+        self.upward = upward
+        # middle[(u, w)] = v for shortcut u-w bypassing v, u < w
+        self.middle = middle
+        self.splits = list(splits)
+
+    @classmethod
+    def build(cls, graph, witness_limit=50, progress=None, cancelled=None, splits=None):
+        '''
+        Contract nodes in order of edge difference (shortcuts added - edges removed).
+        Witness searches are stopped after witness_limit settled nodes, which may
+        add a few unnecessary shortcuts but never loses a shortest path.
+        progress(done, total) is called and cancelled() polled every
+        PROGRESS_STEP contracted nodes, returning None stops the build.
+        Segments split by splits (graph.splits by default) are joined back before
+        contracting.
+        '''
+        splits = sorted(set(graph.splits if splits is None else splits))
+        if splits:
+            graph = graph.without_splits(splits).graph
+        size = len(graph.adjacency)
+        edges = [{} for _ in range(size)]
+        for v, neighbours in enumerate(graph.adjacency):
+            for c, w in neighbours:
+                if w != v and c < edges[v].get(w, float('inf')):
+                    edges[v][w] = c
+
+        middle = {}
+        contracted = [False] * size
+        deleted_neighbours = [0] * size
+        rank = [0] * size
+
+        def witness_distances(source, skip, max_cost, targets):
+            remaining = set(targets)
+            q, seen, mins = [(0, source)], set(), {source: 0}
+            while q and remaining and len(seen) < witness_limit:
+                (cost, v1) = heapq.heappop(q)
+                if v1 in seen:
+                    continue
+                seen.add(v1)
+                remaining.discard(v1)
+                for v2, c in edges[v1].items():
+                    if v2 == skip or contracted[v2] or v2 in seen:
+                        continue
+                    next_ = cost + c
+                    if next_ <= max_cost and next_ < mins.get(v2, float('inf')):
+                        mins[v2] = next_
+                        heapq.heappush(q, (next_, v2))
+            return mins
+
+        def shortcuts(v):
+            neighbours = [(w, c) for w, c in edges[v].items() if not contracted[w]]
+            found = []
+            for i, (u, cu) in enumerate(neighbours):
+                others = neighbours[i+1:]
+                if not others:
+                    continue
+                mins = witness_distances(u, v, cu + max(c for _, c in others),
+                                         [w for w, _ in others])
+                for w, cw in others:
+                    if mins.get(w, float('inf')) > cu + cw:
+                        found.append((u, w, cu + cw))
+            return found, len(neighbours)
+
+        def priority(v):
+            found, degree = shortcuts(v)
+            return len(found) - degree + deleted_neighbours[v]
+
+        q = [(priority(v), v) for v in range(size)]
+        heapq.heapify(q)
+        order = 0
+        while q:
+            _, v = heapq.heappop(q)
+            # Lazy update, contract only if still the best candidate
+            current = priority(v)
+            if q and current > q[0][0]:
+                heapq.heappush(q, (current, v))
+                continue
+
+            found, _ = shortcuts(v)
+            for u, w, distance in found:
+                if distance < edges[u].get(w, float('inf')):
+                    edges[u][w] = edges[w][u] = distance
+                    middle[(min(u, w), max(u, w))] = v
+            contracted[v] = True
+            rank[v] = order
+            order += 1
+            if order % PROGRESS_STEP == 0:
+                if cancelled is not None and cancelled():
+                    return None
+                if progress is not None:
+                    progress(order, size)
+            for w in edges[v]:
+                if not contracted[w]:
+                    deleted_neighbours[w] += 1
+
+        upward = [[(c, w) for w, c in edges[v].items() if rank[w] > rank[v]]
+                  for v in range(size)]
+        return cls(graph.fingerprint(), rank, upward, middle, splits)
+
+    def query(self, f, t, counter=None):
+        '''
+        Bidirectional upward search between node indexes f and t.
+        Returns (distance, path) with the path unpacked to original nodes.
+        '''
+        return self.query_seeded([(0, f)], [(0, t)], counter)
+
+    def query_seeded(self, sources, targets, counter=None):
+        '''
+        query from several nodes to several nodes at once, sources and targets are
+        (distance, node) with the distance to travel before or after the node.
+        Path starts from one of the sources and ends at one of the targets.
+        '''
+        mins, previous = ({}, {}), ({}, {})
+        for side, seeds in enumerate((sources, targets)):
+            for cost, v in seeds:
+                if cost < mins[side].get(v, float('inf')):
+                    mins[side][v] = cost
+                    previous[side][v] = None
+        seen = (set(), set())
+        queues = tuple([(cost, v) for v, cost in side_mins.items()] for side_mins in mins)
+        for q in queues:
+            heapq.heapify(q)
+        best, meet = float('inf'), None
+
+        while True:
+            sides = [s for s in (0, 1) if queues[s] and queues[s][0][0] < best]
+            if not sides:
+                break
+            side = min(sides, key=lambda s: queues[s][0][0])
+            other = 1 - side
+            (cost, v1) = heapq.heappop(queues[side])
+            if v1 in seen[side]:
+                continue
+            seen[side].add(v1)
+            if v1 in mins[other] and cost + mins[other][v1] < best:
+                best, meet = cost + mins[other][v1], v1
+
+            for c, v2 in self.upward[v1]:
+                if v2 in seen[side]:
+                    continue
+                next_ = cost + c
+                if next_ < mins[side].get(v2, float('inf')):
+                    mins[side][v2] = next_
+                    previous[side][v2] = v1
+                    heapq.heappush(queues[side], (next_, v2))
+
+        if counter is not None:
+            counter.add(len(seen[0]) + len(seen[1]))
+        if meet is None:
+            return float('inf'), ()
+        forward = build_path(previous[0], meet)
+        backward = build_path(previous[1], meet)
+        return best, self.unpack(forward + backward[::-1][1:])
+
+    def unpack(self, path):
+        '''Replace shortcuts in path of node indexes with the nodes they bypass'''
+        unpacked = [path[0]]
+        for u, w in zip(path[:-1], path[1:]):
+            stack = [(u, w)]
+            while stack:
+                a, b = stack.pop()
+                v = self.middle.get((min(a, b), max(a, b)))
+                if v is None:
+                    unpacked.append(b)
+                else:
+                    stack.append((v, b))
+                    stack.append((a, v))
+        return tuple(unpacked)
+
+    def paths_from(self, f, targets, counter=None):
+        '''Same as Graph.paths_from, every target is its own (cheap) query'''
+        return {t: self.query(f, t, counter) for t in targets}
+
+    def save(self, file_path):
+        data = {
+            'fingerprint': self.fingerprint,
+            'splits': self.splits,
+            'rank': self.rank,
+            'upward': [[[w, c] for c, w in edges] for edges in self.upward],
+            'middle': [[u, w, v] for (u, w), v in self.middle.items()]
+        }
+        with open(file_path, 'w', encoding='utf-8') as ch_file:
+            json.dump(data, ch_file)
+
+    @classmethod
+    def load(cls, file_path):
+        with open(file_path, 'r') as ch_file:
+            data = json.load(ch_file)
+        upward = [[(c, w) for w, c in edges] for edges in data['upward']]
+        middle = {(u, w): v for u, w, v in data['middle']}
+        # Hierarchies saved before splits were left out have none
+        return cls(data['fingerprint'], data['rank'], upward, middle,
+                   data.get('splits', ()))
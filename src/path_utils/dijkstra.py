@@ -1,35 +1,212 @@
 # Standard
-from collections import defaultdict
 import heapq
+import math
 
 
-def dijkstra(edges, f, t):
+class SearchCounter:
+    '''Counts queries and settled nodes of the searches it is passed to'''
+    def __init__(self):
+        self.queries = 0
+        self.settled = 0
+
+    def add(self, settled):
+        self.queries += 1
+        self.settled += settled
+
+
+def dijkstra(adjacency, f, t, counter=None):
     '''
-    TAKEN FROM: https://gist.github.com/kachayev/5990802
+    BASED ON: https://gist.github.com/kachayev/5990802
 
     Calculate the shortest route between given 2 nodes.
+    adjacency: Graph.adjacency, neighbours of v are targets[k] at distance
+    weights[k] for k in range(offsets[v], offsets[v + 1]). Rows are walked by
+    index so no per-node lists or slices are created during the search.
+    Only predecessors are stored during the search, path is built for the target.
+    '''
+    offsets, targets, weights = adjacency.offsets, adjacency.targets, adjacency.weights
+    q, seen, mins, previous = [(0, f)], set(), {f: 0}, {f: None}
+    while q:
+        (cost, v1) = heapq.heappop(q)
+        if v1 in seen:
+            continue
+        seen.add(v1)
+        if v1 == t:
+            if counter is not None:
+                counter.add(len(seen))
+            return cost, build_path(previous, t)
+
+        for k in range(offsets[v1], offsets[v1 + 1]):
+            v2 = targets[k]
+            if v2 in seen:
+                continue
+            prev = mins.get(v2, None)
+            next_ = cost + weights[k]
+            if prev is None or next_ < prev:
+                mins[v2] = next_
+                previous[v2] = v1
+                heapq.heappush(q, (next_, v2))
+    if counter is not None:
+        counter.add(len(seen))
+    return float("inf"), ()
+
+
+def dijkstra_many(adjacency, f, targets, counter=None):
     '''
+    One-to-many version of dijkstra. Search continues until all given targets are
+    settled and returns {target: (cost, path)}, unreachable targets are left out.
+    '''
+    return dijkstra_seeded(adjacency, [(0, f)], targets, counter)
+
+
+def dijkstra_seeded(adjacency, seeds, targets, counter=None):
+    '''
+    dijkstra_many starting from several nodes at once, seeds are (cost, node) with
+    the distance already travelled to node. Paths start from the seed they came
+    from.
+    '''
+    offsets, neighbours, weights = adjacency.offsets, adjacency.targets, adjacency.weights
+    remaining = set(targets)
+    found = {}
+    q, seen, mins, previous = list(seeds), set(), {}, {}
+    heapq.heapify(q)
+    for cost, v in seeds:
+        if cost < mins.get(v, float('inf')):
+            mins[v] = cost
+            previous[v] = None
+    while q and remaining:
+        (cost, v1) = heapq.heappop(q)
+        if v1 in seen:
+            continue
+        seen.add(v1)
+        if v1 in remaining:
+            remaining.remove(v1)
+            found[v1] = (cost, build_path(previous, v1))
+
+        for k in range(offsets[v1], offsets[v1 + 1]):
+            v2 = neighbours[k]
+            if v2 in seen:
+                continue
+            prev = mins.get(v2, None)
+            next_ = cost + weights[k]
+            if prev is None or next_ < prev:
+                mins[v2] = next_
+                previous[v2] = v1
+                heapq.heappush(q, (next_, v2))
+    if counter is not None:
+        counter.add(len(seen))
+    return found
 
-    g = defaultdict(set)
-    for l, r, c in edges:
-        g[l].add((c, r))
-        g[r].add((c, l))
 
-    q, seen, mins = [(0, f, ())], set(), {f: 0}
+def astar(adjacency, coords, f, t, counter=None):
+    '''
+    A* search between 2 nodes. Straight line distance to t is used as heuristic,
+    it never overestimates because edge lengths are straight line distances too.
+    coords: list indexed by node index containing (x, y)
+    '''
+    offsets, targets, weights = adjacency.offsets, adjacency.targets, adjacency.weights
+    tx, ty = coords[t]
+
+    def heuristic(v):
+        x, y = coords[v]
+        return math.hypot(tx - x, ty - y)
+
+    q, seen, mins, previous = [(heuristic(f), f)], set(), {f: 0}, {f: None}
     while q:
-        (cost, v1, path) = heapq.heappop(q)
-        if v1 not in seen:
-            seen.add(v1)
-            path += (v1, )
-            if v1 == t:
-                return cost, path
-
-            for c, v2 in g.get(v1, ()):
-                if v2 in seen:
-                    continue
-                prev = mins.get(v2, None)
-                next_ = cost + c
-                if prev is None or next_ < prev:
-                    mins[v2] = next_
-                    heapq.heappush(q, (next_, v2, path))
-    return float("inf")
+        (_, v1) = heapq.heappop(q)
+        if v1 in seen:
+            continue
+        seen.add(v1)
+        cost = mins[v1]
+        if v1 == t:
+            if counter is not None:
+                counter.add(len(seen))
+            return cost, build_path(previous, t)
+
+        for k in range(offsets[v1], offsets[v1 + 1]):
+            v2 = targets[k]
+            if v2 in seen:
+                continue
+            prev = mins.get(v2, None)
+            next_ = cost + weights[k]
+            if prev is None or next_ < prev:
+                mins[v2] = next_
+                previous[v2] = v1
+                heapq.heappush(q, (next_ + heuristic(v2), v2))
+    if counter is not None:
+        counter.add(len(seen))
+    return float("inf"), ()
+
+
+def bidirectional(adjacency, f, t, coords=None, counter=None):
+    '''
+    Bidirectional search between 2 nodes, forward from f and backward from t until
+    the frontiers meet. With coords the searches are A* with average potentials
+    p(v) = (h(v, t) - h(v, f)) / 2 which keeps both directions consistent.
+    '''
+    if f == t:
+        if counter is not None:
+            counter.add(1)
+        return 0, (f, )
+
+    if coords is None:
+        def potential(v):
+            return 0
+    else:
+        (fx, fy), (tx, ty) = coords[f], coords[t]
+
+        def potential(v):
+            x, y = coords[v]
+            return (math.hypot(tx - x, ty - y) - math.hypot(fx - x, fy - y)) / 2
+
+    offsets, targets, weights = adjacency.offsets, adjacency.targets, adjacency.weights
+    # Backward potential is the negated forward potential
+    signs = (1, -1)
+    mins = ({f: 0}, {t: 0})
+    previous = ({f: None}, {t: None})
+    seen = (set(), set())
+    queues = ([(potential(f), f)], [(-potential(t), t)])
+    best, meet = float('inf'), None
+
+    while queues[0] and queues[1]:
+        if queues[0][0][0] + queues[1][0][0] >= best:
+            break
+        side = 0 if queues[0][0][0] <= queues[1][0][0] else 1
+        other = 1 - side
+        (_, v1) = heapq.heappop(queues[side])
+        if v1 in seen[side]:
+            continue
+        seen[side].add(v1)
+        cost = mins[side][v1]
+
+        for k in range(offsets[v1], offsets[v1 + 1]):
+            v2 = targets[k]
+            if v2 in seen[side]:
+                continue
+            prev = mins[side].get(v2, None)
+            next_ = cost + weights[k]
+            if prev is None or next_ < prev:
+                mins[side][v2] = next_
+                previous[side][v2] = v1
+                heapq.heappush(queues[side], (next_ + signs[side] * potential(v2), v2))
+            if v2 in mins[other]:
+                through = mins[side][v2] + mins[other][v2]
+                if through < best:
+                    best, meet = through, v2
+
+    if counter is not None:
+        counter.add(len(seen[0]) + len(seen[1]))
+    if meet is None:
+        return float("inf"), ()
+    forward = build_path(previous[0], meet)
+    backward = build_path(previous[1], meet)
+    return best, forward + backward[::-1][1:]
+
+
+def build_path(previous, t):
+    '''Walk predecessors back from t and return path as a tuple starting from source'''
+    path = []
+    while t is not None:
+        path.append(t)
+        t = previous[t]
+    return tuple(reversed(path))
@@ -0,0 +1,123 @@
+# Standard
+import json
+import os
+import threading
+from collections import OrderedDict
+
+# Cached paths can be long node sequences, keep their count bounded
+MAX_ENTRIES = 10000
+# Saving writes the most recently used entries until their paths have this many
+# nodes in total, so a save stays quick however long the paths are
+SAVED_PATH_NODES = 200000
+
+
+def distance_cache_path(file_path):
+    '''Cache is saved next to the node file as <name>.paths.json'''
+    return f'{os.path.splitext(file_path)[0]}.paths.json'
+
+
+class CacheRoute:
+    '''
+    How the entries of one Graph are keyed. Nodes that only split a segment for a
+    target (Graph.splits) are left out like the contraction hierarchy leaves them
+    out: fingerprint is that of the graph with those segments joined back,
+    terminals are keyed by their place in it and paths are stored through the
+    other nodes only. Placing another target then keeps the entries of the other
+    terminals. Without splits nothing is joined back, paths are plain node indexes
+    and terminals get the keys ChainGraph gives its kept nodes.
+    '''
+    def __init__(self, graph):
+        self.coords = graph.coords
+        self.chains = graph.without_splits() if graph.splits else None
+        self.fingerprint = (graph if self.chains is None else self.chains.graph).fingerprint()
+
+    def key(self, v):
+        if self.chains is None:
+            return (v, v, *self.coords[v])
+        return self.chains.terminal_key(v)
+
+    def compact(self, path):
+        return tuple(path) if self.chains is None else self.chains.compact(path)
+
+    def restore(self, f, t, path):
+        return path if self.chains is None else self.chains.restore(f, t, path)
+
+
+class DistanceCache:
+    '''
+    Shortest paths between node pairs shared by every solve. Entries are keyed by
+    the CacheRoute fingerprint and the terminals, so they stay valid as long as the
+    graph is the same and are simply not found after it has been edited (they
+    become valid again if the edit is undone). Least recently used entries are
+    dropped after max_entries.
+
+    Solver writes from the worker thread while GUI may save, so access is locked.
+    '''
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.entries = OrderedDict()
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(fingerprint, f, t):
+        return (fingerprint, f, t) if f <= t else (fingerprint, t, f)
+
+    def get(self, route, f, t):
+        '''Cached (distance, path) from node f to t of route (CacheRoute), None if not cached'''
+        kf, kt = route.key(f), route.key(t)
+        key = self.key(route.fingerprint, kf, kt)
+        with self.lock:
+            found = self.entries.get(key)
+            if found is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+        distance, path = found
+        if distance == float('inf'):
+            return distance, ()
+        return distance, route.restore(f, t, path if kf <= kt else path[::-1])
+
+    def put(self, route, f, t, distance, path):
+        kf, kt = route.key(f), route.key(t)
+        path = route.compact(path)
+        path = path if kf <= kt else path[::-1]
+        key = self.key(route.fingerprint, kf, kt)
+        with self.lock:
+            self.entries[key] = (distance, path)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def save(self, file_path):
+        '''Save most recently used entries, up to SAVED_PATH_NODES path nodes'''
+        with self.lock:
+            saved = []
+            nodes = 0
+            for key, (distance, path) in reversed(self.entries.items()):
+                nodes += len(path)
+                if nodes > SAVED_PATH_NODES:
+                    break
+                saved.append((key, distance, path))
+        graphs = {}
+        # Oldest first, loading keeps the order of use
+        for (fingerprint, f, t), distance, path in reversed(saved):
+            graphs.setdefault(fingerprint, []).append([f, t, distance, path])
+        with open(file_path, 'w', encoding='utf-8') as cache_file:
+            json.dump({'max_entries': self.max_entries, 'graphs': graphs}, cache_file,
+                      separators=(',', ':'))
+
+    @classmethod
+    def load(cls, file_path):
+        with open(file_path, 'r') as cache_file:
+            data = json.load(cache_file)
+        cache = cls(data.get('max_entries', MAX_ENTRIES))
+        for fingerprint, entries in data['graphs'].items():
+            for f, t, distance, path in entries:
+                cache.entries[(fingerprint, tuple(f), tuple(t))] = (distance, tuple(path))
+        return cache
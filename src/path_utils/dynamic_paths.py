@@ -0,0 +1,193 @@
+# Standard
+import heapq
+import itertools
+from collections import OrderedDict
+
+# Shortest path trees kept at once, one per recently used terminal
+MAX_TREES = 16
+# Trees cover the whole route, their total node count is bounded too so that
+# large routes do not keep many copies of it
+MAX_TREE_NODES = 500000
+
+
+class PathTree:
+    '''
+    Shortest path tree of one source: distance and parent of every reached node,
+    children lists only for nodes that have children
+    '''
+    def __init__(self, source):
+        self.source = source
+        self.dist = {source: 0}
+        self.previous = {source: None}
+        self.children = {}
+
+    def set_parent(self, node, parent, distance):
+        old = self.previous.get(node)
+        if old is not None:
+            self.remove_child(old, node)
+        self.dist[node] = distance
+        self.previous[node] = parent
+        if parent is not None:
+            self.children.setdefault(parent, []).append(node)
+
+    def remove_child(self, parent, node):
+        siblings = self.children[parent]
+        siblings.remove(node)
+        if not siblings:
+            del self.children[parent]
+
+    def path(self, node):
+        path = []
+        while node is not None:
+            path.append(node)
+            node = self.previous[node]
+        return tuple(reversed(path))
+
+
+class ShortestPathForest:
+    '''
+    Full shortest path trees from terminals, kept up to date while the route is
+    edited instead of being searched again for every solve.
+
+    Edits are only recorded (edge_changed, node_removed) and trees are repaired
+    when they are queried next, so a chain of edits like splitting a segment is
+    repaired at once. Repair works like Ramalingam-Reps: nodes whose tree path used
+    a removed or lengthened edge lose their distance, get the best distance
+    offered by their unaffected neighbours and the changes are spread with
+    dijkstra. Shortened and new edges are spread the same way. Work is bounded by
+    the part of the tree that actually changed.
+
+    neighbours(node) gives [(length, neighbour), ...] of the current route. Nodes
+    are route node objects, so trees stay valid when node indexes change.
+    Trees are full, so the forest only pays off when every terminal of a solve
+    keeps its tree between solves, see fits().
+    '''
+    def __init__(self, neighbours, max_trees=MAX_TREES, max_nodes=MAX_TREE_NODES):
+        self.neighbours = neighbours
+        self.max_trees = max_trees
+        self.max_nodes = max_nodes
+        self.trees = OrderedDict()
+        self.changed_edges = set()
+        self.removed_nodes = set()
+
+    def edge_changed(self, n1, n2):
+        '''Connection between n1 and n2 was added, removed or its length changed'''
+        self.changed_edges.add((n1, n2))
+
+    def node_moved(self, node):
+        for _, neighbour in self.neighbours(node):
+            self.edge_changed(node, neighbour)
+
+    def node_removed(self, node):
+        '''Call before the connections of node are removed'''
+        self.node_moved(node)
+        self.removed_nodes.add(node)
+
+    def fits(self, terminals, size):
+        '''
+        Trees of all terminals of a route with size nodes can be kept at once.
+        Otherwise the least recently used trees would be dropped before they are
+        used again and every solve would build full trees from scratch.
+        '''
+        return terminals <= self.max_trees and terminals * size <= self.max_nodes
+
+    def paths_from(self, source, targets):
+        '''[(distance, path), ...] from source to each target, (inf, ()) if unreachable'''
+        tree = self.tree(source)
+        found = []
+        for t in targets:
+            if t in tree.dist:
+                found.append((tree.dist[t], tree.path(t)))
+            else:
+                found.append((float('inf'), ()))
+        return found
+
+    def tree(self, source):
+        self.flush()
+        tree = self.trees.get(source)
+        if tree is not None:
+            self.trees.move_to_end(source)
+            return tree
+        tree = PathTree(source)
+        self.spread(tree, [(0, source, None)])
+        self.trees[source] = tree
+        total = sum(len(kept.dist) for kept in self.trees.values())
+        while len(self.trees) > 1 and (len(self.trees) > self.max_trees
+                                       or total > self.max_nodes):
+            _, dropped = self.trees.popitem(last=False)
+            total -= len(dropped.dist)
+        return tree
+
+    def flush(self):
+        '''Repair every tree with the edits recorded since last query'''
+        if not self.changed_edges and not self.removed_nodes:
+            return
+        for source in list(self.trees):
+            if source in self.removed_nodes:
+                del self.trees[source]
+            else:
+                self.repair(self.trees[source])
+        self.changed_edges = set()
+        self.removed_nodes = set()
+
+    def repair(self, tree):
+        current = {}
+        for n1, n2 in self.changed_edges:
+            if n1 in self.removed_nodes or n2 in self.removed_nodes:
+                continue
+            for length, neighbour in self.neighbours(n1):
+                if neighbour is n2:
+                    current[(n1, n2)] = current[(n2, n1)] = length
+
+        # Nodes whose tree path got longer or broken, with all their descendants
+        roots = [node for node in self.removed_nodes if node in tree.dist]
+        for n1, n2 in self.changed_edges:
+            for a, b in (n1, n2), (n2, n1):
+                if tree.previous.get(b) is a and \
+                        current.get((a, b), float('inf')) > tree.dist[b] - tree.dist[a]:
+                    roots.append(b)
+        affected = set()
+        stack = roots
+        while stack:
+            node = stack.pop()
+            if node in affected:
+                continue
+            affected.add(node)
+            stack.extend(tree.children.get(node, ()))
+        for node in affected:
+            parent = tree.previous.pop(node)
+            if parent is not None and parent not in affected:
+                tree.remove_child(parent, node)
+            del tree.dist[node]
+            tree.children.pop(node, None)
+
+        # Best distances offered by the rest of the tree and by changed edges
+        seeds = []
+        for node in affected - self.removed_nodes:
+            for length, neighbour in self.neighbours(node):
+                if neighbour in tree.dist:
+                    seeds.append((tree.dist[neighbour] + length, node, neighbour))
+        for (a, b), length in current.items():
+            if a in tree.dist:
+                seeds.append((tree.dist[a] + length, b, a))
+        self.spread(tree, seeds)
+
+    def spread(self, tree, seeds):
+        '''
+        Dijkstra from seeds (cost, node, parent) that only lowers distances.
+        Source of the tree is the only seed without parent.
+        '''
+        # Counter breaks ties, nodes can not be compared
+        order = itertools.count()
+        q = [(cost, next(order), node, parent) for cost, node, parent in seeds]
+        heapq.heapify(q)
+        while q:
+            cost, _, node, parent = heapq.heappop(q)
+            if parent is not None:
+                if cost >= tree.dist.get(node, float('inf')):
+                    continue
+                tree.set_parent(node, parent, cost)
+            for length, neighbour in self.neighbours(node):
+                next_ = cost + length
+                if next_ < tree.dist.get(neighbour, float('inf')):
+                    heapq.heappush(q, (next_, next(order), neighbour, node))
@@ -0,0 +1,257 @@
+# Standard
+import hashlib
+import math
+from array import array
+
+# Local
+from ..node_file import EdgeRegistry
+from .dijkstra import SearchCounter, dijkstra, dijkstra_many, astar, bidirectional
+
+# Point-to-point search methods of Graph.shortest_path
+SEARCH_METHODS = ['dijkstra', 'astar', 'bidirectional', 'bidirectional_astar', 'hierarchy']
+
+
+class Adjacency:
+    '''
+    Read-only view of CSR arrays: adjacency[v] gives (distance, neighbour) pairs
+    of node v for one-off walks like building a hierarchy. Searches in dijkstra.py
+    read offsets, targets and weights directly instead, indexing a row does not
+    allocate anything.
+    '''
+    __slots__ = ('offsets', 'targets', 'weights')
+
+    def __init__(self, offsets, targets, weights):
+        self.offsets = offsets
+        self.targets = targets
+        self.weights = weights
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, v):
+        start, end = self.offsets[v], self.offsets[v + 1]
+        return zip(self.weights[start:end], self.targets[start:end])
+
+    def __iter__(self):
+        for v in range(len(self)):
+            yield self[v]
+
+
+class Coords:
+    '''Read-only view of coordinate arrays, coords[i] gives (x, y) of node i'''
+    __slots__ = ('xs', 'ys')
+
+    def __init__(self, xs, ys):
+        self.xs = xs
+        self.ys = ys
+
+    def __len__(self):
+        return len(self.xs)
+
+    def __getitem__(self, i):
+        return self.xs[i], self.ys[i]
+
+    def __iter__(self):
+        return zip(self.xs, self.ys)
+
+
+class Graph:
+    '''
+    Route network in compressed sparse rows. Node coordinates and connections are
+    kept in flat typed arrays (neighbours of node v are targets[offsets[v]:
+    offsets[v+1]] with float64 weights), so even a network with millions of nodes
+    takes a few tens of bytes per node and connection. The graph is built once and
+    reused by every shortest path query, so a query only touches the part of the
+    graph it explores.
+    Graph is plain data: nodes are indexes, coords[i] is the (x, y) of node i and
+    adjacency[v] the (distance, neighbour) pairs of v. That makes it a safe snapshot
+    to hand over to a worker.
+
+    Point-to-point queries can be run with method:
+    dijkstra, astar, bidirectional, bidirectional_astar or hierarchy.
+    Without method the attached contraction hierarchy is used if there is one,
+    otherwise dijkstra. counter keeps count of queries and settled nodes.
+    splits are the indexes of nodes that only split a segment for a target, the
+    hierarchy and DistanceCache treat the segment as if it was not split.
+    '''
+    def __init__(self, coords, connections, splits=()):
+        xs, ys = array('d'), array('d')
+        for x, y in coords:
+            xs.append(x)
+            ys.append(y)
+        connections = list(connections)
+
+        # Counting sort of both directions of every connection into rows
+        offsets = array('q', bytes(8 * (len(xs) + 1)))
+        for i, j, _ in connections:
+            offsets[i + 1] += 1
+            offsets[j + 1] += 1
+        for v in range(len(xs)):
+            offsets[v + 1] += offsets[v]
+        fill = offsets[:-1]
+        targets = array('q', bytes(8 * offsets[-1]))
+        weights = array('d', bytes(8 * offsets[-1]))
+        for i, j, distance in connections:
+            for a, b in (i, j), (j, i):
+                k = fill[a]
+                targets[k] = b
+                weights[k] = distance
+                fill[a] = k + 1
+        self.set_arrays(xs, ys, offsets, targets, weights)
+        self.splits = sorted(set(splits))
+
+    def set_arrays(self, xs, ys, offsets, targets, weights):
+        self.xs, self.ys = xs, ys
+        self.offsets, self.targets, self.weights = offsets, targets, weights
+        self.coords = Coords(xs, ys)
+        self.adjacency = Adjacency(offsets, targets, weights)
+        self.counter = SearchCounter()
+        self.hierarchy = None
+        self.digest = None
+        self.chain_graph = None
+        self.split_graph = None
+        self.splits = []
+
+    @classmethod
+    def from_csr(cls, coords, offsets, neighbours, splits=()):
+        '''
+        Graph straight from CSR arrays of a saved route (see node_file.nodes_to_csr),
+        without creating route nodes. Weights are the straight line lengths.
+        '''
+        graph = cls.__new__(cls)
+        xs = array('d', (float(x) for x, _ in coords))
+        ys = array('d', (float(y) for _, y in coords))
+        offsets = array('q', (int(o) for o in offsets))
+        targets = array('q', (int(n) for n in neighbours))
+        weights = array('d', bytes(8 * len(targets)))
+        for v in range(len(xs)):
+            x, y = xs[v], ys[v]
+            for k in range(offsets[v], offsets[v + 1]):
+                w = targets[k]
+                # Same formula as node_file.points_distance, lengths match the GUI
+                weights[k] = math.sqrt((xs[w] - x) ** 2 + (ys[w] - y) ** 2)
+        graph.set_arrays(xs, ys, offsets, targets, weights)
+        graph.splits = sorted(set(int(v) for v in splits))
+        return graph
+
+    @classmethod
+    def from_route_nodes(cls, nodes, edges=None):
+        '''
+        Snapshot of route nodes, node index in graph is its index in nodes.
+        Connections come from EdgeRegistry edges with their cached lengths,
+        or from the connects_with lists if no registry is given.
+        '''
+        if edges is None:
+            edges = EdgeRegistry(nodes)
+        index = {node: i for i, node in enumerate(nodes)}
+        connections = [(index[n1], index[n2], length)
+                       for (n1, n2), length in edges.items()]
+        splits = [i for i, node in enumerate(nodes) if node.split]
+        return cls([(node.x, node.y) for node in nodes], connections, splits)
+
+    def fingerprint(self):
+        '''
+        Hash of node coordinates and connections, changes whenever graph is edited.
+        Graph is never modified, so it is computed only once.
+        '''
+        if self.digest is not None:
+            return self.digest
+        digest = hashlib.sha1()
+        for (x, y), neighbours in zip(self.coords, self.adjacency):
+            connections = sorted(n for _, n in neighbours)
+            digest.update(f'{float(x)!r},{float(y)!r}:{connections};'.encode())
+        self.digest = digest.hexdigest()
+        return self.digest
+
+    def attach_hierarchy(self, hierarchy):
+        '''
+        Use contraction hierarchy for queries if it was built from this exact graph,
+        or from this graph without the nodes splitting segments for targets (splits
+        and hierarchy.splits). Then queries go through a ChainGraph joining those
+        segments back, terminals on them start from both ends of the segment.
+        Returns False and keeps using dijkstra if the graph has changed since.
+        '''
+        self.hierarchy = None
+        if hierarchy is None:
+            return False
+        if hierarchy.fingerprint == self.fingerprint():
+            self.hierarchy = hierarchy
+            return True
+        splits = {*self.splits, *hierarchy.splits}
+        if not splits:
+            return False
+        split_graph = self.without_splits(splits)
+        if split_graph.graph.fingerprint() != hierarchy.fingerprint:
+            return False
+        split_graph.graph.hierarchy = hierarchy
+        self.hierarchy = split_graph
+        return True
+
+    def without_splits(self, splits=None):
+        '''
+        ChainGraph of this graph with the segments split by splits (self.splits by
+        default) joined back. The last one is kept for later calls with the same
+        splits.
+        '''
+        splits = frozenset(v for v in (self.splits if splits is None else splits)
+                           if 0 <= v < len(self.xs))
+        if self.split_graph is None or self.split_graph.splits != splits:
+            from .chains import ChainGraph
+            self.split_graph = ChainGraph(self, splits)
+        return self.split_graph
+
+    def attach_split_graph(self, split_graph):
+        '''Reuse without_splits ChainGraph of an earlier snapshot if the graph is the same'''
+        if split_graph is not None and split_graph.fingerprint == self.fingerprint():
+            self.split_graph = split_graph
+            return True
+        return False
+
+    def chains(self):
+        '''
+        ChainGraph of this graph, contracted on first use and kept for every later
+        query. None if there are too few degree-2 nodes for it to pay off.
+        '''
+        if self.chain_graph is None:
+            from .chains import ChainGraph, collapsible
+            self.chain_graph = ChainGraph(self) if collapsible(self) else False
+        return self.chain_graph or None
+
+    def attach_chains(self, chain_graph):
+        '''Reuse ChainGraph built from an earlier snapshot if the graph is the same'''
+        if chain_graph and chain_graph.fingerprint == self.fingerprint():
+            self.chain_graph = chain_graph
+            return True
+        return False
+
+    def shortest_path(self, f, t, method=None):
+        '''
+        Returns (distance, path) between two nodes, (inf, ()) if not connected.
+        Raises ValueError for an unknown method or hierarchy without one attached.
+        '''
+        if method is None:
+            method = 'dijkstra' if self.hierarchy is None else 'hierarchy'
+        if method == 'hierarchy':
+            if self.hierarchy is None:
+                raise ValueError('No contraction hierarchy for this route')
+            return self.hierarchy.query(f, t, self.counter)
+        elif method == 'dijkstra':
+            return dijkstra(self.adjacency, f, t, self.counter)
+        elif method == 'astar':
+            return astar(self.adjacency, self.coords, f, t, self.counter)
+        elif method == 'bidirectional':
+            return bidirectional(self.adjacency, f, t, counter=self.counter)
+        elif method == 'bidirectional_astar':
+            return bidirectional(self.adjacency, f, t, self.coords, self.counter)
+        raise ValueError(f'Unknown search method: {method}')
+
+    def paths_from(self, f, targets):
+        '''
+        Returns {target: (distance, path)} for all targets with a single search
+        from f. Unreachable targets get (inf, ()).
+        With a contraction hierarchy every target is its own (cheap) query.
+        '''
+        if self.hierarchy is not None:
+            return self.hierarchy.paths_from(f, targets, self.counter)
+        found = dijkstra_many(self.adjacency, f, targets, self.counter)
+        return {t: found.get(t, (float('inf'), ())) for t in targets}
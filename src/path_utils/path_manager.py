@@ -1,33 +1,57 @@
 # Standard
-from math import factorial
-from itertools import permutations
+import os
+import time
 
 # Local
-from ..node_file import points_distance
-from .dijkstra import dijkstra
-from .tsp import tsp
+from .distance_cache import CacheRoute
+from .tsp import tsp, iterated_tsp, path_length
+
+# Environment variable limiting Held-Karp worker processes when not given
+PROCESSES_ENV = 'PATH_PLANNER_PROCESSES'
+
 
 class PathManager:
-    def __init__(self, progress_bar, nodes, targets, start, end):
-        self.pb = progress_bar
-        self.nodes = nodes
+    def __init__(self, graph, start, end, targets, progress=None, cancelled=None,
+                 cache=None, paths_from=None, processes=None, search=None):
+        '''
+        graph: Graph snapshot of the route, start, end and targets are node indexes.
+        graph can be None when paths_from is given and there is no cache or search.
+        progress(msg, done, total) is called while solving and cancelled() is
+        polled, returning True from it stops the solve.
+        cache: DistanceCache, terminal pairs found in it are not searched again.
+        paths_from(f, targets) replaces graph.paths_from, e.g. to answer from
+        shortest path trees that are kept up to date between solves.
+        processes: worker processes for Held-Karp. By default PROCESSES_ENV if it
+        is set, otherwise all cores (see held_karp for memory per worker).
+        search: one of graph.SEARCH_METHODS to search every terminal pair with
+        Graph.shortest_path, by default one search per terminal finds all the rest.
+        '''
+        self.graph = graph
+        self.cache = cache
+        self.paths_from = paths_from
+        self.processes = processes or int(os.environ.get(PROCESSES_ENV) or 0) \
+            or os.cpu_count() or 1
+        self.search = search
         self.start_node = start
         self.end_node = end
-        self.target_nodes = [n.parent_node for n in targets]
-        self.distances = self.get_unique_connections()
+        self.target_nodes = list(targets)
+        self.progress = progress
+        self.cancelled = cancelled
+
+    def report(self, msg, done, total):
+        if self.progress is not None:
+            self.progress(msg, done, total)
 
-    def activate_progressbar(self, msg, maximum):
-        '''Set message and max value for progress bar'''
-        self.pb.setWindowTitle(msg)
-        self.pb.setMaximum(maximum)
-        self.pb.setMinimum(0)
-        self.pb.forceShow()
+    def is_cancelled(self):
+        return self.cancelled is not None and self.cancelled()
 
     def get_shortest_route(self, mode):
         '''
-        dijkstra: Go through all possible routes/permutations of targets and return
-        shortest
-        tsp: Treat path as travelling salesman -problem, not as accurate
+        dijkstra: Exact shortest route through all targets (Held-Karp)
+        tsp: Treat path as travelling salesman -problem, faster but not as accurate
+        Returns (distance, route), route is empty if solve was cancelled.
+        Raises ValueError if start, end and targets are not all connected or there
+        are too many targets for dijkstra.
         '''
         if mode == 'dijkstra':
             return self.absolute_shortest_path()
@@ -35,146 +59,156 @@ class PathManager:
             return self.shortest_by_tsp()
 
     # Absolute shortest route methods
-    def get_unique_connections(self):
-        '''
-        Creates a list which contains all connections between nodes and the distance.
-        Stripts duplicate connections like (A, B), (B, A).
-        connections = [(node_object, node_object, distance), ...]
-        '''
-        pairs = []
-        for node in self.nodes:
-            assert node.connects_with, 'Found node without connections, exiting.'
-            for connection in node.connects_with:
-                # Continue if connection already in list from other node
-                if (node, connection)[::-1] in pairs:
-                    continue
-                pairs.append((node, connection))
-
-        # Add distances
-        connections = []
-        for con in pairs:
-            p1, p2 = con[0], con[1]
-            distance = points_distance((p1.x, p1.y), (p2.x, p2.y))
-            connections.append(con + (distance, ))
-        return connections
-
     def absolute_shortest_path(self):
         '''
         Gets shortest route between start node and end node while going through all
-        the target nodes. Creates all possible permutations of the targets and
-        returns the shortest path.
+        the target nodes. Distances between start, targets and end are calculated
+        once and the visiting order is solved with Held-Karp.
+        '''
+        # Held-Karp needs numpy, it is imported only when an exact solve is run
+        from .held_karp import held_karp, MAX_TARGETS
+        if len(self.target_nodes) > MAX_TARGETS:
+            raise ValueError(f'Absolute shortest supports up to {MAX_TARGETS} targets')
+        terminals = [self.start_node] + self.target_nodes + [self.end_node]
+        matrix, paths = self.terminal_distance_matrix(terminals)
+        if matrix is None:
+            return 0, []
+
+        progress = lambda done, total: self.report('Calculating shortest path..',
+                                                   done, total)
+        result = held_karp(matrix, progress=progress, cancelled=self.is_cancelled,
+                           processes=self.processes)
+        if result is None:
+            return 0, []
+        distance, order = result
+        return distance, self.order_to_route(terminals, order, paths)
+
+    def anytime_shortest_path(self, budget):
         '''
-        self.activate_progressbar('Calculating all possible paths..',
-                                  factorial(len(self.target_nodes)))
-        permutation_count = 0
-
-        shortest_distance = float('inf')
-        shortest_route = None
-
-        for perm in permutations(self.target_nodes):
-            if self.pb.wasCanceled():
-                return 0, []
-            permutation_count += 1
-            self.pb.setValue(permutation_count)
-
-            dist, route = self.full_path_length(list(perm))
-            if dist > shortest_distance:
-                continue
-            shortest_distance, shortest_route = dist, route
-        return shortest_distance, shortest_route
-
-    def full_path_length(self, permutation):
+        Generator yielding progressively shorter (distance, route) until budget
+        seconds have passed, the route is known to be optimal or solve is cancelled.
+        The last yielded route is always the best one found. Raises ValueError
+        before yielding anything if the terminals are not all connected and
+        TimeoutError if budget runs out before the first route is found.
+
+        First route comes from the tsp heuristic. Up to MAX_TARGETS targets
+        Held-Karp is then run against the deadline, with more targets the heuristic
+        route is improved with iterated local search.
         '''
-        Calculates the distance between start- and end-node while going through the
-        target nodes for given permutation of targets.
+        from .held_karp import held_karp, MAX_TARGETS
+        started = time.monotonic()
+
+        def stop():
+            return self.is_cancelled() or time.monotonic() - started > budget
+
+        terminals = [self.start_node] + self.target_nodes + [self.end_node]
+        matrix, paths = self.terminal_distance_matrix(terminals, cancelled=stop)
+        if matrix is None:
+            if self.is_cancelled():
+                return
+            raise TimeoutError(f'No route found within {budget} seconds, '
+                               'distances between targets took longer')
+        order = tsp(matrix)
+        best = path_length(order, matrix)
+        yield best, self.order_to_route(terminals, order, paths)
+
+        if len(self.target_nodes) <= MAX_TARGETS:
+            progress = lambda done, total: self.report('Calculating shortest path..',
+                                                       done, total)
+            result = held_karp(matrix, progress=progress, cancelled=stop,
+                               processes=self.processes)
+            if result is not None and result[0] < best:
+                distance, order = result
+                yield distance, self.order_to_route(terminals, order, paths)
+            return
+
+        for length, order in iterated_tsp(matrix, order):
+            if stop():
+                return
+            self.report('Searching shorter routes..',
+                        int(time.monotonic() - started), budget)
+            if length < best:
+                best = length
+                yield best, self.order_to_route(terminals, order, paths)
+
+    def terminal_distance_matrix(self, terminals, cancelled=None):
         '''
-        total_distance = 0
+        Shortest distances and paths between every pair of given terminal nodes.
+        Returns (matrix, paths) where paths[(i, j)] is the node path from
+        terminals[i] to terminals[j], (None, None) if cancelled. cancelled()
+        replaces is_cancelled, e.g. to stop at a deadline.
+        Raises ValueError as soon as some terminal is found unreachable, Held-Karp
+        and tsp can not order terminals with infinite distances between them.
+        '''
+        size = len(terminals)
+        matrix = [[0.0] * size for _ in range(size)]
+        paths = {}
+        route = CacheRoute(self.graph) if self.cache is not None else None
+        cancelled = cancelled or self.is_cancelled
+        for i in range(size):
+            if cancelled():
+                return None, None
+            self.report('Calculating distances between targets..', i, size)
+            found, missing = {}, []
+            for t in terminals[i+1:]:
+                cached = None if self.cache is None else self.cache.get(route,
+                                                                        terminals[i], t)
+                if cached is None:
+                    missing.append(t)
+                else:
+                    found[t] = cached
+            if missing:
+                # One search settles all remaining terminals
+                searched = self.search_paths(terminals[i], missing)
+                found.update(searched)
+                if self.cache is not None:
+                    for t, (dist, path) in searched.items():
+                        self.cache.put(route, terminals[i], t, dist, path)
+            for j in range(i + 1, size):
+                dist, path = found[terminals[j]]
+                matrix[i][j] = matrix[j][i] = dist
+                paths[(i, j)] = path
+                paths[(j, i)] = path[::-1]
+            # Rest of the terminals are connected if all of them are reached from start
+            if i == 0 and float('inf') in matrix[0]:
+                raise ValueError('All targets are not connected')
+        return matrix, paths
+
+    def search_paths(self, f, targets):
+        '''
+        {target: (distance, path)} from f. With search every pair is a point-to-point
+        search of that method. Otherwise, without a hierarchy searches run on the
+        graph with degree-2 chains collapsed, contracted once per graph.
+        '''
+        if self.search is not None:
+            return {t: self.graph.shortest_path(f, t, self.search) for t in targets}
+        if self.paths_from is not None:
+            return self.paths_from(f, targets)
+        if self.graph.hierarchy is None:
+            chains = self.graph.chains()
+            if chains is not None:
+                return chains.paths_from(f, targets)
+        return self.graph.paths_from(f, targets)
+
+    def order_to_route(self, terminals, order, paths):
+        '''Join terminal-to-terminal paths in given order into one node route'''
         route = []
-
-        # Add start and end nodes to permutation
-        permutation.insert(0, self.start_node)
-        permutation.append(self.end_node)
-
-        # Calculate target paths in permutation
-        for i, node in enumerate(permutation[:-1]):
-            dist, path = dijkstra(self.distances, node, permutation[i+1])
-            total_distance += dist
+        for i, j in zip(order[:-1], order[1:]):
             # Remove last because it is in next paths first (remove duplicate)
-            route.extend(path[:-1])
-
-        route.append(self.end_node)
-        return total_distance, route
+            route.extend(paths[(i, j)][:-1])
+        route.append(terminals[order[-1]])
+        return route
 
     # Travelling salesman methods
     def shortest_by_tsp(self):
-        distances, paths, node_indexes = self.target_nodes_distances()
-        # Add 3 because start-/end-node + dummy are not included in targets
-        num_of_nodes = len(self.target_nodes) + 3
-        tsp_path = list(tsp(distances=distances, num_of_nodes=num_of_nodes))
-        node_path = self.indexlist_to_path(node_indexes, tsp_path, paths)
-        return 0, node_path
-
-    def target_nodes_distances(self):
-        '''
-        Get distances between targets with dijkstra.
-        [(index_of_fist_node, index_of_second_node, distance_by_path)...]
         '''
-        nodes = self.target_nodes.copy()
-        nodes.extend([self.start_node, self.end_node])
-        node_indexes = {
-            0: 'dummy'
-        }
-        target_distances = []
-        target_paths = []
-
-        # Make sure distance is never the same
-        deny_equal = 0.0000001
-        for i, n1 in enumerate(nodes):
-            node_indexes[i+1] = n1
-            # Add dummy distance/path to set start and end point
-            dist = deny_equal if n1 in [self.start_node, self.end_node] else 10000 + deny_equal
-            target_distances.append((i+1, 0, dist))
-            target_paths.append((n1, 'dummy', ()))
-            deny_equal += deny_equal
-            for j, n2 in enumerate(nodes[i+1:]):
-                dist, path = dijkstra(self.distances, n1, n2)
-                target_distances.append((i+1, i+j+2, dist))
-                target_paths.append((n1, n2, path))
-        
-        return target_distances, target_paths, node_indexes
-
-    def get_path_between_nodes(self, n1, n2, paths):
-        '''Find path between nodes which was calculated earlier in target_nodes_distances()'''
-        for route in paths:
-            connection = (route[0], route[1])
-            if connection == (n1, n2):
-                return list(route[2][:-1])
-            elif connection == (n2, n1):
-                return list(route[2][::-1][:-1])
-        return None
-
-    def indexlist_to_path(self, index_dict, tsp_path, paths):
+        Approximate route, targets are ordered with nearest neighbour + 2-opt/Or-opt
+        local search over the terminal distance matrix.
         '''
-        tsp_path: path by node indexes
-        index_dict: dict of node indexes
-        '''
-        path = [index_dict[i] for i in tsp_path]
-        
-        # Rotate until dummy-node is first
-        while path[0] != 'dummy':
-            path = path[-1:] + path[:-1]
-        
-        # Remove first item (dummy node) from list
-        node_path = path[1:]
-        
-        # If start node is at the start of list keep it that way, else reverse list
-        # as the first is end node.
-        node_path = node_path if node_path[0] == self.start_node else node_path[::-1]
-
-        shortest_path = []
-        for node, next_node in zip(node_path[:-1], node_path[1:]):
-            path_between_nodes = self.get_path_between_nodes(node, next_node, paths)
-            shortest_path.extend(path_between_nodes)
-        shortest_path.append(self.end_node)
-        return shortest_path
-
+        terminals = [self.start_node] + self.target_nodes + [self.end_node]
+        matrix, paths = self.terminal_distance_matrix(terminals)
+        if matrix is None:
+            return 0, []
+        self.report('Ordering targets..', 0, 1)
+        order = tsp(matrix)
+        return path_length(order, matrix), self.order_to_route(terminals, order, paths)
@@ -1,9 +1,166 @@
-from mlrose_hiive import TravellingSales, TSPOpt, genetic_alg
+# Standard
+import random
 
-def tsp(distances=None, num_of_nodes=None):
-    '''https://mlrose.readthedocs.io/en/stable/source/tutorial2.html'''
 
-    fitness_coordinates = TravellingSales(distances=distances)
-    problem_fit = TSPOpt(length=num_of_nodes, fitness_fn=fitness_coordinates, maximize=False)
-    best_route, _ = genetic_alg(problem_fit, random_state=2)
-    return best_route
+def tsp(distances, neighbours=10):
+    '''
+    Approximate shortest open path through a distance matrix. Index 0 is start,
+    the last index is end and every index between is visited once.
+
+    Path is built with nearest neighbour and then improved with 2-opt and Or-opt
+    moves until neither finds an improvement. Moves are only tried towards the
+    closest `neighbours` nodes of each node, which keeps a pass close to linear.
+    Returns order of matrix indexes from start to end.
+    '''
+    end = len(distances) - 1
+    if end <= 1:
+        return list(range(end + 1))
+
+    route = nearest_neighbour(distances)
+    local_search(route, distances, neighbour_lists(distances, neighbours))
+    return route
+
+
+def iterated_tsp(distances, route, neighbours=10, seed=0):
+    '''
+    Endless iterated local search starting from route. Every round perturbs the best
+    route with a double bridge move (swap of two inner segments), improves it with
+    local search and keeps it if it got shorter. Yields (length, best_route) after
+    every round, the caller decides when to stop.
+    '''
+    near = neighbour_lists(distances, neighbours)
+    rnd = random.Random(seed)
+    best = list(route)
+    best_length = path_length(best, distances)
+    # Need at least 3 inner nodes to have two segments to swap
+    if len(best) < 5:
+        return
+    while True:
+        i, j, k = sorted(rnd.sample(range(1, len(best) - 1), 3))
+        candidate = best[:i] + best[j:k] + best[i:j] + best[k:]
+        local_search(candidate, distances, near)
+        length = path_length(candidate, distances)
+        if length < best_length - 1e-9:
+            best, best_length = candidate, length
+        yield best_length, best
+
+
+def neighbour_lists(distances, neighbours):
+    '''Closest `neighbours` indexes of every index, closest first'''
+    size = len(distances)
+    return [sorted((j for j in range(size) if j != i),
+                   key=lambda j, row=distances[i]: row[j])[:neighbours]
+            for i in range(size)]
+
+
+def local_search(route, distances, near):
+    '''Improve route in place with 2-opt and Or-opt until neither helps'''
+    improved = True
+    while improved:
+        improved = two_opt(route, distances, near)
+        improved = or_opt(route, distances, near) or improved
+
+
+def path_length(route, distances):
+    '''Length of route given as matrix indexes'''
+    return sum(distances[a][b] for a, b in zip(route[:-1], route[1:]))
+
+
+def nearest_neighbour(distances):
+    '''Start from index 0, always go to the closest unvisited target, end at last'''
+    end = len(distances) - 1
+    unvisited = set(range(1, end))
+    route = [0]
+    while unvisited:
+        row = distances[route[-1]]
+        closest = min(unvisited, key=row.__getitem__)
+        unvisited.remove(closest)
+        route.append(closest)
+    route.append(end)
+    return route
+
+
+def two_opt(route, distances, near):
+    '''
+    Reverse parts of the route in place while it gets shorter. First and last
+    index are never moved. Returns True if the route was changed.
+    '''
+    d = distances
+    last = len(route) - 1
+    position = {node: i for i, node in enumerate(route)}
+    changed = False
+    improved = True
+    while improved:
+        improved = False
+        for i in range(last):
+            a, b = route[i], route[i+1]
+            for c in near[a]:
+                if d[a][c] >= d[a][b]:
+                    break
+                j = position[c]
+                if j > i + 1 and j < last:
+                    # Edges (a, b) and (c, e) become (a, c) and (b, e)
+                    e = route[j+1]
+                    delta = d[a][c] + d[b][e] - d[a][b] - d[c][e]
+                    lo, hi = i + 1, j
+                elif j < i and i < last:
+                    # Edges (c, e) and (a, b) become (c, a) and (e, b)
+                    e = route[j+1]
+                    delta = d[c][a] + d[e][b] - d[c][e] - d[a][b]
+                    lo, hi = j + 1, i
+                else:
+                    continue
+                if delta < -1e-9:
+                    route[lo:hi+1] = route[lo:hi+1][::-1]
+                    for k in range(lo, hi + 1):
+                        position[route[k]] = k
+                    improved = changed = True
+                    break
+    return changed
+
+
+def or_opt(route, distances, near):
+    '''
+    Move segments of 1-3 targets next to one of their closest nodes, reversed
+    if that is shorter. Returns True if the route was changed.
+    '''
+    d = distances
+    changed = False
+    improved = True
+    while improved:
+        improved = False
+        for length in (1, 2, 3):
+            i = 1
+            while i + length < len(route):
+                segment = route[i:i+length]
+                first, last = segment[0], segment[-1]
+                prev, next_ = route[i-1], route[i+length]
+                removal = d[prev][first] + d[last][next_] - d[prev][next_]
+
+                best = None
+                rest = route[:i] + route[i+length:]
+                position = {node: k for k, node in enumerate(rest)}
+                for c in set(near[first] + near[last]):
+                    k = position.get(c)
+                    if k is None:
+                        continue
+                    # Insert after c, or before c, end node stays last
+                    for k1 in (k, k - 1):
+                        if k1 < 0 or k1 + 1 >= len(rest):
+                            continue
+                        p, n = rest[k1], rest[k1+1]
+                        if (p, n) == (prev, next_):
+                            continue
+                        forward = d[p][first] + d[last][n] - d[p][n]
+                        backward = d[p][last] + d[first][n] - d[p][n]
+                        insert, reverse = min((forward, False), (backward, True))
+                        if insert - removal < -1e-9 and (best is None or insert < best[0]):
+                            best = (insert, k1, reverse)
+                if best is None:
+                    i += 1
+                    continue
+                _, k1, reverse = best
+                route[:] = rest[:k1+1] + (segment[::-1] if reverse else segment) \
+                    + rest[k1+1:]
+                improved = changed = True
+    return changed
@@ -0,0 +1,295 @@
+'''
+Local routing service keeping route files loaded between requests.
+
+    python serve.py maps/city.npz maps/harbour.json --port 8765
+
+Maps are named by their file name without extension, names must be unique.
+Requests are HTTP/1.1 with JSON bodies, connections are kept alive:
+    GET /maps     -> {"maps": ["city", "harbour"]}
+    POST /solve   {"map": "city", "start": 12, "end": [350, 80], "targets": [..]}
+                  -> same result as a batch.py result line
+Jobs are the same as for batch.py. Concurrent requests to the same map are
+collected for BATCH_WINDOW seconds and solved together, spread over the worker
+processes. Every worker has all maps loaded when it starts. A batch that is not
+solved within --timeout seconds fails with 500, its stuck workers are replaced
+by a new pool and other unfinished batches are sent to it again.
+'''
+# Standard
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+
+# Local
+from .batch import load_state, solve
+
+# Requests to the same map arriving within this many seconds share a batch
+BATCH_WINDOW = 0.002
+# Batch is sent right away when it gets this big
+BATCH_SIZE = 16
+# Seconds a batch may take before its workers are considered stuck
+BATCH_TIMEOUT = 60
+MAX_BODY = 1 << 20
+
+STATUS = {
+    200: '200 OK',
+    400: '400 Bad Request',
+    404: '404 Not Found',
+    413: '413 Payload Too Large',
+    500: '500 Internal Server Error'
+}
+
+# Loaded maps of a worker process, {name: state}
+_worker_maps = {}
+
+
+def map_names(paths):
+    '''
+    {name: path} for route files, name is the file name without extension.
+    Raises ValueError if two files would get the same name.
+    '''
+    maps = {}
+    for path in paths:
+        name = os.path.splitext(os.path.basename(path))[0]
+        if name in maps:
+            raise ValueError(f'Maps {maps[name]} and {path} are both named {name!r}')
+        maps[name] = path
+    return maps
+
+
+def init_worker(maps):
+    '''Pool initializer, load every map once per worker process'''
+    for name, path in maps.items():
+        _worker_maps[name] = load_state(path)
+
+
+def solve_batch(name, jobs):
+    state = _worker_maps[name]
+    return [solve(state, job) for job in jobs]
+
+
+def warm_up():
+    '''Nothing to do, running it starts a worker which loads the maps'''
+    return os.getpid()
+
+
+class RoutingService:
+    '''
+    Collects solve requests per map into batches and runs them in a process pool.
+    Workers are started with the service, so the first request does not wait for
+    maps to load.
+    '''
+    def __init__(self, maps, processes, timeout=BATCH_TIMEOUT):
+        self.maps = maps
+        self.processes = processes
+        self.timeout = timeout
+        self.pool = self.new_pool()
+        # Bumped when the pool is replaced, results of the old pool are ignored
+        self.generation = 0
+        # {name: ([(job, future), ...], flush timer)}
+        self.pending = {}
+        # {pool future: (name, [(job, future), ...], timeout timer)}
+        self.running = {}
+
+    def new_pool(self):
+        # Forked workers would inherit the event loop and its signal handlers
+        return multiprocessing.get_context('spawn').Pool(self.processes,
+                                                         initializer=init_worker,
+                                                         initargs=(self.maps, ))
+
+    async def start(self):
+        await asyncio.gather(*[self.run(warm_up) for _ in range(self.processes)])
+
+    def close(self):
+        self.pool.terminate()
+
+    def run(self, function, *args):
+        '''Run function in the pool, returns a future of this event loop'''
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        generation = self.generation
+
+        def settle(result, error):
+            if future.done() or generation != self.generation:
+                return
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+        # Pool calls these from its result thread
+        self.pool.apply_async(
+            function, args,
+            callback=lambda result: loop.call_soon_threadsafe(settle, result, None),
+            error_callback=lambda error: loop.call_soon_threadsafe(settle, None, error))
+        return future
+
+    async def solve(self, name, job):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if name not in self.pending:
+            timer = loop.call_later(BATCH_WINDOW, self.flush, name)
+            self.pending[name] = ([], timer)
+        batch, _ = self.pending[name]
+        batch.append((job, future))
+        if len(batch) >= BATCH_SIZE:
+            self.flush(name)
+        return await future
+
+    def flush(self, name):
+        '''Send pending requests of map to workers, split so that none stays idle'''
+        batch, timer = self.pending.pop(name)
+        timer.cancel()
+        size = -(-len(batch) // self.processes)
+        for i in range(0, len(batch), size):
+            self.submit(name, batch[i:i+size])
+
+    def submit(self, name, batch):
+        loop = asyncio.get_running_loop()
+        done = self.run(solve_batch, name, [job for job, _ in batch])
+        timer = loop.call_later(self.timeout, self.timed_out, done)
+        self.running[done] = (name, batch, timer)
+        done.add_done_callback(self.deliver)
+
+    def deliver(self, done):
+        if done not in self.running:
+            # Timed out or sent again to a new pool
+            return
+        _, batch, timer = self.running.pop(done)
+        timer.cancel()
+        error = done.exception()
+        for i, (_, future) in enumerate(batch):
+            if future.done():
+                continue
+            if error is None:
+                future.set_result(done.result()[i])
+            else:
+                future.set_exception(error)
+
+    def timed_out(self, done):
+        '''Fail the batch and replace the pool, its worker may never return'''
+        _, batch, _ = self.running.pop(done)
+        done.cancel()
+        error = TimeoutError(f'Not solved within {self.timeout} seconds')
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(error)
+        self.restart()
+
+    def restart(self):
+        '''Replace the pool and send unfinished batches to the new one'''
+        self.pool.terminate()
+        self.pool = self.new_pool()
+        self.generation += 1
+        running, self.running = self.running, {}
+        for done, (name, batch, timer) in running.items():
+            timer.cancel()
+            done.cancel()
+            self.submit(name, batch)
+
+    async def route(self, method, path, body):
+        '''Returns (status, payload) for a request'''
+        if method == 'GET' and path == '/maps':
+            return 200, {'maps': sorted(self.maps)}
+        if method != 'POST' or path != '/solve':
+            return 404, {'error': f'No such endpoint: {method} {path}'}
+        try:
+            job = json.loads(body)
+        except ValueError as err:
+            return 400, {'error': f'{type(err).__name__}: {err}'}
+        if not isinstance(job, dict):
+            return 400, {'error': 'Request must be a JSON object'}
+        name = job.pop('map', None)
+        if name not in self.maps:
+            return 404, {'error': f'No such map: {name}'}
+        result = await self.solve(name, job)
+        return (400 if 'error' in result else 200), result
+
+    async def handle(self, reader, writer):
+        '''Serve HTTP/1.1 requests of one connection until it is closed'''
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    key, _, value = line.decode('latin-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+
+                length = int(headers.get('content-length', 0))
+                if length > MAX_BODY:
+                    status, payload = 413, {'error': 'Request is too large'}
+                    headers['connection'] = 'close'
+                else:
+                    body = await reader.readexactly(length)
+                    try:
+                        status, payload = await self.route(method, path, body)
+                    except Exception as err:
+                        # Worker failed or timed out, the connection is still usable
+                        status, payload = 500, {'error': f'{type(err).__name__}: {err}'}
+
+                data = json.dumps(payload).encode()
+                writer.write(f'HTTP/1.1 {STATUS[status]}\r\n'
+                             f'Content-Type: application/json\r\n'
+                             f'Content-Length: {len(data)}\r\n\r\n'.encode() + data)
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(maps, host, port, unix_path, processes, timeout):
+    service = RoutingService(maps, processes, timeout)
+    await service.start()
+    if unix_path:
+        server = await asyncio.start_unix_server(service.handle, path=unix_path)
+    else:
+        server = await asyncio.start_server(service.handle, host, port)
+    address = unix_path or f'http://{host}:{port}'
+    print(f'Serving {", ".join(sorted(maps))} on {address}', flush=True)
+
+    # Stop cleanly on SIGTERM too, so worker processes are not left behind
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in signal.SIGINT, signal.SIGTERM:
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            # Windows, Ctrl+C still ends asyncio.run with KeyboardInterrupt
+            pass
+    try:
+        async with server:
+            await stop.wait()
+    finally:
+        service.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Local routing service')
+    parser.add_argument('nodes', nargs='+', help='saved route files (.npz or .json)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', help='listen on unix socket path instead of tcp')
+    parser.add_argument('-p', '--processes', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--timeout', type=float, default=BATCH_TIMEOUT,
+                        help='seconds a batch may take before it fails')
+    args = parser.parse_args(argv)
+    try:
+        maps = map_names(args.nodes)
+    except ValueError as err:
+        parser.error(str(err))
+    try:
+        asyncio.run(serve(maps, args.host, args.port, args.unix,
+                          args.processes, args.timeout))
+    except KeyboardInterrupt:
+        pass
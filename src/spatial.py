@@ -0,0 +1,227 @@
+# Standard
+import math
+
+# 3rd party
+import numpy as np
+
+# Local
+from .node_file import EdgeRegistry, points_distance, project_to_segment
+
+
+def cells_in_rect(cells, cell_size, rect):
+    '''
+    Keys of occupied cells overlapping rect (x1, y1, x2, y2). Walks the cell range
+    of the rect, or all occupied cells if there are fewer of those.
+    '''
+    x1, y1, x2, y2 = rect
+    cx1, cy1 = math.floor(x1 / cell_size), math.floor(y1 / cell_size)
+    cx2, cy2 = math.floor(x2 / cell_size), math.floor(y2 / cell_size)
+    if (cx2 - cx1 + 1) * (cy2 - cy1 + 1) > len(cells):
+        return [(cx, cy) for cx, cy in cells if cx1 <= cx <= cx2 and cy1 <= cy <= cy2]
+    return [(cx, cy) for cx in range(cx1, cx2 + 1) for cy in range(cy1, cy2 + 1)
+            if (cx, cy) in cells]
+
+
+class NodeGrid:
+    '''
+    Uniform grid over route nodes. Every node is kept in the cell its coordinates
+    fall in, so finding nodes near a point only looks at the surrounding cells
+    no matter how many nodes there are.
+    '''
+    def __init__(self, nodes=(), cell_size=20):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.node_cells = {}
+        for node in nodes:
+            self.add(node)
+
+    def cell(self, x, y):
+        return (math.floor(x / self.cell_size), math.floor(y / self.cell_size))
+
+    def add(self, node):
+        cell = self.cell(node.x, node.y)
+        self.cells.setdefault(cell, set()).add(node)
+        self.node_cells[node] = cell
+
+    def remove(self, node):
+        cell = self.node_cells.pop(node, None)
+        if cell is None:
+            return
+        self.cells[cell].discard(node)
+        if not self.cells[cell]:
+            del self.cells[cell]
+
+    def move(self, node):
+        '''Put node to the right cell after its coordinates have changed'''
+        if self.node_cells.get(node) != self.cell(node.x, node.y):
+            self.remove(node)
+            self.add(node)
+
+    def nodes_near(self, pos, radius):
+        '''Nodes in cells that overlap the square of radius around pos'''
+        x1, y1 = self.cell(pos[0] - radius, pos[1] - radius)
+        x2, y2 = self.cell(pos[0] + radius, pos[1] + radius)
+        for cx in range(x1, x2 + 1):
+            for cy in range(y1, y2 + 1):
+                yield from self.cells.get((cx, cy), ())
+
+    def nodes_in_rect(self, rect):
+        '''Nodes inside rect (x1, y1, x2, y2)'''
+        x1, y1, x2, y2 = rect
+        return [node for cell in cells_in_rect(self.cells, self.cell_size, rect)
+                for node in self.cells[cell]
+                if x1 <= node.x <= x2 and y1 <= node.y <= y2]
+
+    def nearest(self, pos, radius):
+        '''Closest node within radius of pos, None if there is none'''
+        closest, closest_dist = None, radius
+        for node in self.nodes_near(pos, radius):
+            dist = points_distance((node.x, node.y), pos)
+            if dist <= closest_dist:
+                closest, closest_dist = node, dist
+        return closest
+
+
+def snap_points_to_segments(points, segments):
+    '''
+    Find closest segment for all points at once, segments = [(node, node), ...].
+    Points are handled in chunks so the point x segment arrays stay around 16MB.
+    Returns arrays (segment_indexes, lerps, snapped_points) where lerp is the
+    position of the snapped point along its segment from 0 to 1.
+    '''
+    a = np.array([(n1.x, n1.y) for n1, _ in segments], dtype=np.float64)
+    b = np.array([(n2.x, n2.y) for _, n2 in segments], dtype=np.float64)
+    d = b - a
+    dr2 = (d ** 2).sum(axis=1) + 0.0000001
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+
+    indexes = np.empty(len(points), dtype=np.int64)
+    lerps = np.empty(len(points))
+    chunk = max(1, 1000000 // len(segments))
+    for start in range(0, len(points), chunk):
+        p = points[start:start+chunk]
+        lerp = (((p[:, None, :] - a) * d).sum(axis=2) / dr2).clip(0, 1)
+        dist2 = ((a + lerp[..., None] * d - p[:, None, :]) ** 2).sum(axis=2)
+        best = dist2.argmin(axis=1)
+        indexes[start:start+chunk] = best
+        lerps[start:start+chunk] = lerp[np.arange(len(p)), best]
+
+    snapped = a[indexes] + lerps[:, None] * d[indexes]
+    return indexes, lerps, snapped
+
+
+class SegmentGrid:
+    '''
+    Uniform grid over route segments, a segment is listed in every cell it passes.
+    Closest segment search checks rings of cells around the point and stops as soon
+    as no unchecked cell can hold anything closer than the best found.
+    '''
+    def __init__(self, edges=(), cell_size=50):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.segment_cells = {}
+        # Cell bounds ever used (x1, y1, x2, y2), only grows
+        self.bounds = None
+        for n1, n2 in edges:
+            self.add(n1, n2)
+
+    def cell(self, x, y):
+        return (math.floor(x / self.cell_size), math.floor(y / self.cell_size))
+
+    def cells_on_segment(self, n1, n2):
+        '''Cells the segment goes through, column by column'''
+        (x1, y1), (x2, y2) = sorted([(n1.x, n1.y), (n2.x, n2.y)])
+        cs = self.cell_size
+        cells = []
+        for cx in range(math.floor(x1 / cs), math.floor(x2 / cs) + 1):
+            if x1 == x2:
+                ya, yb = y1, y2
+            else:
+                # Part of the segment that is inside this column
+                lo, hi = max(x1, cx * cs), min(x2, (cx + 1) * cs)
+                ya = y1 + (y2 - y1) * (lo - x1) / (x2 - x1)
+                yb = y1 + (y2 - y1) * (hi - x1) / (x2 - x1)
+            for cy in range(math.floor(min(ya, yb) / cs), math.floor(max(ya, yb) / cs) + 1):
+                cells.append((cx, cy))
+        return cells
+
+    def add(self, n1, n2):
+        key = EdgeRegistry.key(n1, n2)
+        self.remove(n1, n2)
+        cells = self.cells_on_segment(n1, n2)
+        for cell in cells:
+            self.cells.setdefault(cell, set()).add(key)
+        self.segment_cells[key] = cells
+        xs = [cx for cx, _ in cells]
+        ys = [cy for _, cy in cells]
+        if self.bounds is None:
+            self.bounds = (min(xs), min(ys), max(xs), max(ys))
+        else:
+            x1, y1, x2, y2 = self.bounds
+            self.bounds = (min(x1, min(xs)), min(y1, min(ys)),
+                           max(x2, max(xs)), max(y2, max(ys)))
+
+    def remove(self, n1, n2):
+        key = EdgeRegistry.key(n1, n2)
+        for cell in self.segment_cells.pop(key, ()):
+            self.cells[cell].discard(key)
+            if not self.cells[cell]:
+                del self.cells[cell]
+
+    def remove_node(self, node):
+        for connection in node.connects_with:
+            self.remove(node, connection)
+
+    def update_node(self, node):
+        '''Move segments of node to the right cells after node has moved'''
+        for connection in node.connects_with:
+            self.add(node, connection)
+
+    def segments_in_rect(self, rect):
+        '''Segments passing cells that overlap rect (x1, y1, x2, y2)'''
+        found = set()
+        for cell in cells_in_rect(self.cells, self.cell_size, rect):
+            found.update(self.cells[cell])
+        return list(found)
+
+    def closest(self, point):
+        '''
+        Closest point to point on any segment in the grid, rounded to whole pixels.
+        Returns (closest_point, pair), (None, None) if grid is empty.
+        '''
+        if not self.cells:
+            return None, None
+        px, py = self.cell(*point)
+        # No segment is further away than this many rings
+        x1, y1, x2, y2 = self.bounds
+        max_ring = max(px - x1, x2 - px, py - y1, y2 - py, 0)
+
+        checked = set()
+        closest_point, dist_to_closest, pair = None, math.inf, None
+        for ring in range(max_ring + 1):
+            # Anything in rings further away is at least this far
+            if dist_to_closest <= (ring - 1) * self.cell_size:
+                break
+            for cell in self.ring_cells(px, py, ring):
+                for key in self.cells.get(cell, ()):
+                    if key in checked:
+                        continue
+                    checked.add(key)
+                    (x, y), dist = project_to_segment(point, key[0], key[1])
+                    if dist < dist_to_closest:
+                        dist_to_closest = dist
+                        closest_point = (int(x), int(y))
+                        pair = key
+        return closest_point, pair
+
+    @staticmethod
+    def ring_cells(px, py, ring):
+        if ring == 0:
+            yield (px, py)
+            return
+        for cx in range(px - ring, px + ring + 1):
+            yield (cx, py - ring)
+            yield (cx, py + ring)
+        for cy in range(py - ring + 1, py + ring):
+            yield (px - ring, cy)
+            yield (px + ring, cy)
@@ -1,21 +1,46 @@
+# Standard
+import math
+
 # 3rd party
+import numpy as np
 from PyQt5 import QtWidgets, QtGui, QtCore
 
 # Local
-from ..node_file import RouteNode, TargetNode, closest_segment_point
-from ..path_utils.path_manager import PathManager
+from ..node_file import RouteNode, EdgeRegistry, load_targets_from_file
+from ..path_utils.distance_cache import DistanceCache
+from ..path_utils.dynamic_paths import ShortestPathForest
+from ..path_utils.held_karp import MAX_TARGETS
+from ..spatial import NodeGrid, SegmentGrid, snap_points_to_segments
+from .path_worker import PathWorker, HierarchyWorker
+from .target_node import TargetNode
+from .tiled_image import open_image, draw_image
+
+
+# Zoom is relative to the whole image fitted into the canvas
+MAX_ZOOM = 64
+# Above this many visible lines/nodes a simplified level of detail is drawn
+LOD_LIMIT = 5000
+# Layers cover this fraction of the view more on every side, panning inside the
+# margin only moves the cached layers
+LAYER_MARGIN = 0.25
 
 
 class Canvas(QtWidgets.QLabel):
     info_signal = QtCore.pyqtSignal(str)
     new_target_signal = QtCore.pyqtSignal(object)
+    new_targets_signal = QtCore.pyqtSignal(list)
     del_target_signal = QtCore.pyqtSignal(object)
     toggle_menu_signal = QtCore.pyqtSignal(str)
+    path_found_signal = QtCore.pyqtSignal(object)
+    hierarchy_signal = QtCore.pyqtSignal(object)
 
     def __init__(self):
         super().__init__()
         self.image = None
         self.route_nodes = []
+        self.edges = EdgeRegistry()
+        self.node_grid = NodeGrid()
+        self.segment_grid = SegmentGrid()
         self.start_node = None
         self.end_node = None
         self.mode = 'view'
@@ -24,25 +49,59 @@ class Canvas(QtWidgets.QLabel):
         self.pairing_node = None
         self.target_nodes = []
         self.target_actual_pos = None
+        self.background_layer = None
+        self.background_key = None
+        self.route_layer = None
+        self.route_layer_key = None
+        # Part of the image the layers cover and size and zoom they were drawn at
+        self.layer_rect = None
+        self.layer_view = None
+        self.zoom = 1
+        self.offset = (0, 0)
+        self.pan_start = None
+        self.hierarchy = None
+        # Terminal paths of earlier solves, valid as long as the graph is the same
+        self.distance_cache = DistanceCache()
+        self.path_forest = self.new_path_forest()
+        # Route with degree-2 chains collapsed, reused while the route is the same
+        self.chain_graph = None
+        # Route with target splits joined back for the hierarchy and distance
+        # cache, reused likewise
+        self.split_graph = None
+        self.worker = None
+        self.solve_nodes = None
+        self.progress_bar = None
 
     # Canvas-related methods
     def change_mode(self, mode):
         if mode != 'view' and self.shortest_path:
             self.shortest_path = []
         self.mode = mode
-        self.update()
+        self.route_changed()
 
     def allow_mode_change(self):
-        return self.image is not None
+        return self.image is not None and self.worker is None
 
     def clear_all_nodes(self):
+        if self.worker is not None:
+            # Routes from the old nodes are not wanted anymore
+            self.worker.cancel()
+            self.solve_nodes = None
         self.route_nodes = []
+        self.edges = EdgeRegistry()
+        self.node_grid = NodeGrid()
+        self.segment_grid = SegmentGrid()
+        # New forest instead of reset, cancelled worker may still be reading the old
+        self.path_forest = self.new_path_forest()
+        self.hierarchy = None
+        self.chain_graph = None
+        self.split_graph = None
         self.target_nodes = []
         self.start_node = None
         self.end_node = None
         self.pairing_node = None
         self.mode = 'route_edit'
-        self.update()
+        self.route_changed()
 
     def clear_selections(self):
         self.selected_node = None
@@ -79,7 +138,7 @@ class Canvas(QtWidgets.QLabel):
         pen.setWidth(width[style])
         return pen
 
-    def get_node_color(self, node):
+    def get_node_color(self, node, highlight=True):
         node_colors = {
             'normal': (0, 0, 255),
             'pairing': (0, 255, 0),
@@ -87,33 +146,93 @@ class Canvas(QtWidgets.QLabel):
             'end': (255, 0, 127),
             'selected': (255, 0, 0)
         }
-        if node == self.selected_node:
+        if highlight and node == self.selected_node:
             return node_colors['selected']
         elif node == self.start_node:
             return node_colors['start']
         elif node == self.end_node:
             return node_colors['end']
-        elif node == self.pairing_node:
+        elif highlight and node == self.pairing_node:
             return node_colors['pairing']
         return node_colors['normal']
 
     def new_image(self, img):
-        self.image = QtGui.QPixmap(img)
+        self.image = open_image(img)
+        self.background_layer = None
+        self.layer_rect = None
+        self.zoom = 1
+        self.offset = (0, 0)
         self.toggle_menu_signal.emit('allow_path_calculate')
-        self.update()
+        self.route_changed()
 
     def translate_original_to_resized(self, x, y):
-        new_x = x * self.width() / self.image.width()
-        new_y = y * self.height() / self.image.height()
+        sx, sy = self.view_scale()
+        new_x = (x - self.offset[0]) * sx
+        new_y = (y - self.offset[1]) * sy
         return (new_x, new_y)
 
-    def translated_mousepos(self, x, y):
-        trns_x = x / (self.width() / self.image.width())
-        trns_y = y / (self.height() / self.image.height())
+    def translated_mousepos(self, x, y, exact=False):
+        '''Image coordinates of canvas position, whole pixels unless exact'''
+        sx, sy = self.view_scale()
+        trns_x = x / sx + self.offset[0]
+        trns_y = y / sy + self.offset[1]
+        if exact:
+            return (trns_x, trns_y)
         return (int(trns_x), int(trns_y))
 
-    def calculate_path(self, mode):
-        if self.start_node is None:
+    # Viewport
+    def view_scale(self):
+        '''Canvas pixels per image pixel on both axes'''
+        return (self.width() / self.image.width() * self.zoom,
+                self.height() / self.image.height() * self.zoom)
+
+    def visible_rect(self):
+        '''Visible part of the image in image coordinates (x1, y1, x2, y2)'''
+        sx, sy = self.view_scale()
+        ox, oy = self.offset
+        return (ox, oy, ox + self.width() / sx, oy + self.height() / sy)
+
+    def layer_rect_around(self, rect):
+        '''rect grown by LAYER_MARGIN on every side, kept inside the image'''
+        x1, y1, x2, y2 = rect
+        mx, my = (x2 - x1) * LAYER_MARGIN, (y2 - y1) * LAYER_MARGIN
+        return (max(x1 - mx, 0), max(y1 - my, 0),
+                min(x2 + mx, self.image.width()), min(y2 + my, self.image.height()))
+
+    def layer_covers(self, rect):
+        if self.layer_rect is None:
+            return False
+        lx1, ly1, lx2, ly2 = self.layer_rect
+        x1, y1, x2, y2 = rect
+        # Visible rect may pass the image edge by a rounding error
+        return lx1 <= x1 + 1e-6 and ly1 <= y1 + 1e-6 \
+            and x2 - 1e-6 <= lx2 and y2 - 1e-6 <= ly2
+
+    def zoom_at(self, pos, factor):
+        '''Zoom by factor keeping the image point under pos in place'''
+        sx, sy = self.view_scale()
+        ix, iy = pos.x() / sx + self.offset[0], pos.y() / sy + self.offset[1]
+        self.zoom = min(max(self.zoom * factor, 1), MAX_ZOOM)
+        sx, sy = self.view_scale()
+        self.set_offset(ix - pos.x() / sx, iy - pos.y() / sy)
+
+    def pan(self, dx, dy):
+        '''Move view by canvas pixels'''
+        sx, sy = self.view_scale()
+        self.set_offset(self.offset[0] - dx / sx, self.offset[1] - dy / sy)
+
+    def set_offset(self, x, y):
+        '''Set top left corner of the view, kept inside the image'''
+        max_x = self.image.width() * (1 - 1 / self.zoom)
+        max_y = self.image.height() * (1 - 1 / self.zoom)
+        self.offset = (min(max(x, 0), max_x), min(max(y, 0), max_y))
+        self.update()
+
+    def calculate_path(self, mode, budget=None):
+        if self.worker is not None:
+            self.info_signal.emit('Path is already being calculated!')
+            return
+        elif self.start_node is None:
             self.info_signal.emit('Start node is not set!')
             return
         elif self.end_node is None:
@@ -125,58 +244,157 @@ class Canvas(QtWidgets.QLabel):
         elif any([True for n in self.route_nodes if not n.connects_with]):
             self.info_signal.emit('All nodes are not connected!')
             return
+        elif mode == 'dijkstra' and len(self.target_nodes) > MAX_TARGETS:
+            self.info_signal.emit(f'Absolute shortest supports up to {MAX_TARGETS} targets!')
+            return
 
-        progress_bar = None
-        if mode == 'dijkstra':
-            progress_bar = QtWidgets.QProgressDialog(self)
-            progress_bar.setWindowModality(QtCore.Qt.WindowModal)
-        path_manager = PathManager(progress_bar, self.route_nodes, self.target_nodes,
-                                   self.start_node, self.end_node)
-        distance, path = path_manager.get_shortest_route(mode)
-        if not path:
+        # Worker builds a plain data snapshot, found routes are node indexes in it
+        self.solve_nodes = list(self.route_nodes)
+        index = {node: i for i, node in enumerate(self.solve_nodes)}
+        targets = [index[target.parent_node] for target in self.target_nodes]
+        # Kept trees answer if all terminals fit in the forest, then the worker
+        # does not need a snapshot of the route. Else it uses the hierarchy unless
+        # the graph was edited after building it (segments split for targets since
+        # then do not count as edits), or searches the route with chains collapsed.
+        paths_from = None
+        terminals = len(set(targets) | {index[self.start_node], index[self.end_node]})
+        if self.path_forest.fits(terminals, len(self.solve_nodes)):
+            paths_from = self.forest_paths_from(self.path_forest, self.solve_nodes, index)
+        self.worker = PathWorker(self.solve_nodes, self.edges, index[self.start_node],
+                                 index[self.end_node], targets, mode, budget,
+                                 self.distance_cache, paths_from, self.chain_graph,
+                                 self.hierarchy, self.split_graph)
+
+        self.worker.route_signal.connect(self.route_found)
+        self.worker.error_signal.connect(self.info_signal.emit)
+        self.start_worker('Calculating path')
+
+    def build_hierarchy(self):
+        '''
+        Build contraction hierarchy of the current route in the background, route
+        is not edited meanwhile. hierarchy_signal is emitted when it is ready.
+        '''
+        if self.worker is not None:
+            self.info_signal.emit('Wait for the running calculation to finish!')
+            return False
+        # Segments split for targets are joined back, so other targets can be
+        # placed later without making the hierarchy out of date
+        self.worker = HierarchyWorker(list(self.route_nodes), self.edges)
+        self.worker.hierarchy_signal.connect(self.hierarchy_built)
+        self.start_worker('Building hierarchy')
+        return True
+
+    def hierarchy_built(self, hierarchy):
+        self.hierarchy = hierarchy
+        self.hierarchy_signal.emit(hierarchy)
+
+    def start_worker(self, title):
+        '''Show progress dialog of self.worker, cancelling it cancels the worker'''
+        self.progress_bar = QtWidgets.QProgressDialog('Starting..', 'Cancel', 0, 0, self)
+        self.progress_bar.setWindowTitle(title)
+        self.progress_bar.setAutoClose(False)
+        self.progress_bar.setAutoReset(False)
+        self.progress_bar.canceled.connect(self.worker.cancel)
+        self.worker.progress_signal.connect(self.update_progress)
+        self.worker.finished.connect(self.worker_finished)
+        self.progress_bar.show()
+        self.worker.start()
+
+    def new_path_forest(self):
+        edges = self.edges
+        return ShortestPathForest(
+            lambda node: [(edges.length(node, c), c) for c in node.connects_with])
+
+    @staticmethod
+    def forest_paths_from(forest, nodes, index):
+        '''
+        Graph.paths_from replacement answering from the kept shortest path trees.
+        Runs in the worker, route is not edited meanwhile.
+        '''
+        def paths_from(f, targets):
+            found = forest.paths_from(nodes[f], [nodes[t] for t in targets])
+            return {t: (distance, tuple(index[node] for node in path))
+                    for t, (distance, path) in zip(targets, found)}
+        return paths_from
+
+    def update_progress(self, msg, done, total):
+        if self.progress_bar is None:
             return
+        self.progress_bar.setLabelText(msg)
+        self.progress_bar.setRange(0, total)
+        self.progress_bar.setValue(done)
+
+    def route_found(self, distance, route):
+        if self.solve_nodes is None:
+            return
+        self.show_path([self.solve_nodes[i] for i in route])
+
+    def worker_finished(self):
+        progress_bar, self.progress_bar = self.progress_bar, None
+        progress_bar.close()
+        # Graph of a solve that was not cancelled by clearing the route
+        graph = None
+        if self.solve_nodes is not None and isinstance(self.worker, PathWorker):
+            graph = self.worker.graph
+        self.worker = None
+        self.solve_nodes = None
+        # Chains collapsed during the solve are valid until the route is edited
+        if graph is not None and graph.chain_graph:
+            self.chain_graph = graph.chain_graph
+        if graph is not None and graph.split_graph is not None:
+            self.split_graph = graph.split_graph
+
+    def show_path(self, path):
         self.shortest_path = path
         self.mode = 'view'
         self.toggle_menu_signal.emit('view')
-        self.update()
+        self.path_found_signal.emit(path)
+        self.route_changed()
 
     # Route-related methods
     def set_start_node(self):
         self.start_node = self.selected_node
-        self.update()
+        self.route_changed()
 
     def set_end_node(self):
         if self.end_node is not None:
             self.end_node.color = (0, 0, 255)
         self.selected_node.color = (255, 0, 127)
         self.end_node = self.selected_node
-        self.update()
+        self.route_changed()
 
-    def add_route_node(self, pos=None):
+    def add_route_node(self, pos=None, split=False):
+        '''split: node only splits a segment for a target'''
         mx, my = self.mousepos if pos is None else pos
-        self.route_nodes.append(RouteNode(mx, my, (0, 0, 255)))
+        new_node = RouteNode(mx, my, (0, 0, 255), split)
+        self.route_nodes.append(new_node)
+        self.node_grid.add(new_node)
+        self.route_changed()
 
     def del_route_node(self):
-        for node in self.route_nodes:
-            cleaned_list = [n for n in node.connects_with if n != self.selected_node]
-            node.connects_with = cleaned_list
+        self.path_forest.node_removed(self.selected_node)
+        self.edges.remove_node(self.selected_node)
+        self.segment_grid.remove_node(self.selected_node)
+        for node in self.selected_node.connects_with:
+            node.connects_with.remove(self.selected_node)
+        self.selected_node.connects_with = []
         self.route_nodes.remove(self.selected_node)
+        self.node_grid.remove(self.selected_node)
         for target in self.target_nodes:
             if target.parent_node != self.selected_node:
                 continue
             self.remove_target(target)
-        self.update()
+        self.route_changed()
 
     def new_connection(self):
         pn, sn = self.pairing_node, self.selected_node
         if pn == sn:
             self.clear_selections()
             return
-        if sn in pn.connects_with or pn in sn.connects_with:
+        if (sn, pn) in self.edges:
             return
 
-        sn.connects_with.append(pn)
-        pn.connects_with.append(sn)
+        self.connect_nodes(sn, pn)
 
         self.pairing_node.pairing = False
         self.pairing_node = None
@@ -184,31 +402,54 @@ class Canvas(QtWidgets.QLabel):
         self.toggle_menu_signal.emit('route_edit')
 
     def push_node_between_pairs(self, pair):
+        self.push_nodes_between_pairs(pair, [self.route_nodes[-1]])
+
+    def push_nodes_between_pairs(self, pair, new_nodes):
+        '''Replace connection of pair with a chain through new_nodes (ordered from n1)'''
         n1, n2 = pair
-        n1.connects_with.remove(n2)
-        n2.connects_with.remove(n1)
+        self.disconnect_nodes(n1, n2)
+
+        chain = [n1] + new_nodes + [n2]
+        for node, next_node in zip(chain[:-1], chain[1:]):
+            self.connect_nodes(node, next_node)
 
-        new_node = self.route_nodes[-1]
-        for node in n1, n2:
-            node.connects_with.append(new_node)
-            new_node.connects_with.append(node)
+    def connect_nodes(self, n1, n2):
+        n1.connects_with.append(n2)
+        n2.connects_with.append(n1)
+        self.edges.add(n1, n2)
+        self.segment_grid.add(n1, n2)
+        self.path_forest.edge_changed(n1, n2)
+        self.route_changed()
 
-    def get_route_lines(self):
-        lines = []
+    def disconnect_nodes(self, n1, n2):
+        n1.connects_with.remove(n2)
+        n2.connects_with.remove(n1)
+        self.edges.remove(n1, n2)
+        self.segment_grid.remove(n1, n2)
+        self.path_forest.edge_changed(n1, n2)
+        self.route_changed()
+
+    def load_route_nodes(self, route_nodes):
+        self.route_nodes = route_nodes
+        self.edges.reset(route_nodes)
+        self.path_forest = self.new_path_forest()
+        self.node_grid = NodeGrid(route_nodes)
+        self.segment_grid = SegmentGrid(self.edges)
+        self.route_changed()
+
+    def get_route_lines(self, rect=None):
+        '''Lines to draw, only the ones that may cross rect if it is given'''
         if self.shortest_path and self.mode == 'view':
-            for n1, n2 in zip(self.shortest_path[:-1], self.shortest_path[1:]):
-                lines.append((n1, n2))
-        else:
-            for node in self.route_nodes:
-                # Continue if node doesn't have any connections
-                if not node.connects_with:
-                    continue
-                for connection in node.connects_with:
-                    # Continue if connection already in list from other node
-                    if (node, connection)[::-1] in lines:
-                        continue
-                    lines.append((node, connection))
-        return lines
+            lines = zip(self.shortest_path[:-1], self.shortest_path[1:])
+            if rect is None:
+                return list(lines)
+            x1, y1, x2, y2 = rect
+            return [(n1, n2) for n1, n2 in lines
+                    if max(n1.x, n2.x) >= x1 and min(n1.x, n2.x) <= x2
+                    and max(n1.y, n2.y) >= y1 and min(n1.y, n2.y) <= y2]
+        if rect is None:
+            return list(self.edges)
+        return self.segment_grid.segments_in_rect(rect)
 
     # Target-related methods
     def add_target_node(self):
@@ -220,14 +461,61 @@ class Canvas(QtWidgets.QLabel):
         if not done or txt == '':
             return
         mx, my = self.mousepos
-        pos, pair = closest_segment_point(self.mousepos, self.get_route_lines())
+        pos, pair = self.segment_grid.closest(self.mousepos)
 
         num = len(self.target_nodes) + 1
-        self.add_route_node(pos)
+        self.add_route_node(pos, split=True)
         self.push_node_between_pairs(pair)
         new_target = TargetNode(num, txt, mx, my, self.route_nodes[-1])
         self.target_nodes.append(new_target)
         self.new_target_signal.emit(new_target)
+        self.route_changed()
+
+    def import_targets(self, path):
+        '''
+        Add all targets from file at once. Points are snapped to their closest
+        segments in one vectorized pass, segments getting several targets are split
+        into a chain ordered along the segment.
+        '''
+        if self.worker is not None:
+            self.info_signal.emit('Path is being calculated!')
+            return
+        unconnected_nodes = any([True for n in self.route_nodes if not n.connects_with])
+        if len(self.route_nodes) < 2 or unconnected_nodes:
+            self.info_signal.emit('Draw route and connect all nodes first')
+            return
+        rows = load_targets_from_file(path)
+        if not rows:
+            return
+
+        segments = list(self.edges)
+        indexes, lerps, snapped = snap_points_to_segments(
+            [(x, y) for _, x, y in rows], segments)
+
+        by_segment = {}
+        for row, index in enumerate(indexes):
+            by_segment.setdefault(int(index), []).append(row)
+
+        parent_nodes = {}
+        for index, rows_on_segment in by_segment.items():
+            rows_on_segment.sort(key=lambda row: lerps[row])
+            new_nodes = []
+            for row in rows_on_segment:
+                x, y = snapped[row]
+                self.add_route_node((int(x), int(y)), split=True)
+                new_nodes.append(self.route_nodes[-1])
+                parent_nodes[row] = self.route_nodes[-1]
+            self.push_nodes_between_pairs(segments[index], new_nodes)
+
+        new_targets = []
+        for row, (name, x, y) in enumerate(rows):
+            num = len(self.target_nodes) + 1
+            new_target = TargetNode(num, name, x, y, parent_nodes[row])
+            self.target_nodes.append(new_target)
+            new_targets.append(new_target)
+        self.shortest_path = []
+        self.new_targets_signal.emit(new_targets)
+        self.route_changed()
 
     def remove_target(self, target):
         self.target_nodes.remove(target)
@@ -238,57 +526,174 @@ class Canvas(QtWidgets.QLabel):
         for i, item in enumerate(self.target_nodes):
             item.num = i+1
             item.update_text()
+        self.route_changed()
 
     # Events
     def paintEvent(self, event):
+        '''
+        Canvas is drawn in layers. Image and route drawing around the visible part
+        are cached in pixmaps that are only moved while panning. Route layer is
+        redrawn after route_changed() or when size, mode, zoom changes or the view
+        leaves the layers. Only hovered and pairing nodes are drawn every time.
+        '''
         if not self.image:
             return
 
+        # Layers are rebuilt only when the view leaves them or zoom or size changes
+        sx, sy = self.view_scale()
+        view_key = (self.width(), self.height(), self.zoom)
+        visible = self.visible_rect()
+        if self.layer_view != view_key or not self.layer_covers(visible):
+            self.layer_rect = self.layer_rect_around(visible)
+            self.layer_view = view_key
+        lx1, ly1, lx2, ly2 = self.layer_rect
+        layer_size = QtCore.QSize(math.ceil((lx2 - lx1) * sx), math.ceil((ly2 - ly1) * sy))
+
+        layer_key = view_key + (self.layer_rect, )
+        if self.background_layer is None or self.background_key != layer_key:
+            self.background_layer = QtGui.QPixmap(layer_size)
+            bg_painter = QtGui.QPainter(self.background_layer)
+            bg_painter.setRenderHint(QtGui.QPainter.SmoothPixmapTransform)
+            draw_image(bg_painter, QtCore.QRectF(self.background_layer.rect()), self.image,
+                       QtCore.QRectF(lx1, ly1, lx2 - lx1, ly2 - ly1))
+            bg_painter.end()
+            self.background_key = layer_key
+
+        route_key = layer_key + (self.mode, )
+        if self.route_layer is None or self.route_layer_key != route_key:
+            self.route_layer = QtGui.QPixmap(layer_size)
+            self.route_layer.fill(QtCore.Qt.transparent)
+            layer_painter = QtGui.QPainter(self.route_layer)
+            layer_painter.setRenderHint(QtGui.QPainter.Antialiasing)
+            self.draw_route_layer(layer_painter, self.layer_rect)
+            layer_painter.end()
+            self.route_layer_key = route_key
+
         p = QtGui.QPainter(self)
-        p.setRenderHint(QtGui.QPainter.Antialiasing)
-        p.drawPixmap(self.rect(), self.image)
+        corner = QtCore.QPointF(*self.translate_original_to_resized(lx1, ly1))
+        p.drawPixmap(corner, self.background_layer)
+        p.drawPixmap(corner, self.route_layer)
+
+        # Overlay
+        if self.mode != 'view':
+            pen = QtGui.QPen()
+            pen.setWidth(10)
+            for node in [self.pairing_node, self.selected_node]:
+                if node is None:
+                    continue
+                r, g, b = self.get_node_color(node)
+                pen.setColor(QtGui.QColor(r, g, b))
+                p.setPen(pen)
+                p.drawPoint(QtCore.QPointF(*self.translate_original_to_resized(node.x,
+                                                                              node.y)))
+
+    def route_changed(self):
+        '''Route, targets or path changed, route layer has to be redrawn'''
+        self.route_layer = None
+        self.update()
+
+    def draw_route_layer(self, p, rect):
+        '''
+        Draw targets, route lines and nodes inside rect of the image, rect is the
+        area the painter covers. With more than LOD_LIMIT lines they are snapped to
+        whole pixels and duplicates are dropped, with more than LOD_LIMIT nodes
+        nodes are not drawn.
+        '''
+        x1, y1, x2, y2 = rect
+        sx, sy = self.view_scale()
+
+        def to_layer(x, y):
+            return (x - x1) * sx, (y - y1) * sy
+
         pen = QtGui.QPen()
         p.setFont(QtGui.QFont('Decorative', 10))
         # Draw target
-        if self.target_nodes:
-            for node in self.target_nodes:
-                drx, dry = self.translate_original_to_resized(node.draw_x, node.draw_y)
-                x, y = self.translate_original_to_resized(node.parent_node.x,
-                                                          node.parent_node.y)
-                p.setPen(self.set_pen_style(pen, 'target_line'))
-                p.drawLine(drx, dry, x, y)
-
-                p.setPen(self.set_pen_style(pen, 'target_node_draw'))
-                p.drawEllipse(drx-3, dry-3, 6, 6)
-                p.setPen(self.set_pen_style(pen, 'text'))
-                p.drawText(drx-3, dry+3, str(node.num))
+        for node in self.target_nodes:
+            if not (x1 <= node.draw_x <= x2 and y1 <= node.draw_y <= y2):
+                continue
+            drx, dry = to_layer(node.draw_x, node.draw_y)
+            x, y = to_layer(node.parent_node.x, node.parent_node.y)
+            p.setPen(self.set_pen_style(pen, 'target_line'))
+            p.drawLine(QtCore.QLineF(drx, dry, x, y))
+
+            p.setPen(self.set_pen_style(pen, 'target_node_draw'))
+            p.drawEllipse(QtCore.QRectF(drx-3, dry-3, 6, 6))
+            p.setPen(self.set_pen_style(pen, 'text'))
+            p.drawText(QtCore.QPointF(drx-3, dry+3), str(node.num))
 
         # Draw route
-        route_lines = self.get_route_lines()
+        route_lines = self.get_route_lines(rect)
         if route_lines:
             style = 'route_line_shortest' if self.shortest_path else 'route_line'
             p.setPen(self.set_pen_style(pen, style))
-            for p1, p2 in route_lines:
-                p1_x, p1_y = self.translate_original_to_resized(p1.x, p1.y)
-                p2_x, p2_y = self.translate_original_to_resized(p2.x, p2.y)
-                p.drawLine(p1_x, p1_y, p2_x, p2_y)
-            if self.shortest_path and self.mode == 'view':
-                start_and_end = [self.start_node, self.end_node]
-                for node, style in zip(start_and_end, ['start_node', 'end_node']):
-                    p.setPen(self.set_pen_style(pen, style))
-                    x, y = self.translate_original_to_resized(node.x, node.y)
-                    p.drawEllipse(x-5, y-5, 10, 10)
+            lines = np.array([(n1.x, n1.y, n2.x, n2.y) for n1, n2 in route_lines],
+                             dtype=np.float64)
+            lines -= (x1, y1, x1, y1)
+            lines *= (sx, sy, sx, sy)
+            if len(lines) > LOD_LIMIT:
+                lines = self.simplify_lines(lines)
+            p.drawLines(self.point_pairs(lines))
+        if self.shortest_path and self.mode == 'view':
+            start_and_end = [self.start_node, self.end_node]
+            for node, style in zip(start_and_end, ['start_node', 'end_node']):
+                p.setPen(self.set_pen_style(pen, style))
+                x, y = to_layer(node.x, node.y)
+                p.drawEllipse(QtCore.QRectF(x-5, y-5, 10, 10))
 
         if self.route_nodes and self.mode != 'view':
+            visible_nodes = self.node_grid.nodes_in_rect(rect)
+            if len(visible_nodes) > LOD_LIMIT:
+                return
             pen.setWidth(10)
-            for node in self.route_nodes:
-                r, g, b = self.get_node_color(node)
+            # Hovered and pairing nodes are drawn on top of this layer
+            by_color = {}
+            for node in visible_nodes:
+                color = self.get_node_color(node, highlight=False)
+                by_color.setdefault(color, QtGui.QPolygonF()).append(
+                    QtCore.QPointF((node.x - x1) * sx, (node.y - y1) * sy))
+            for (r, g, b), points in by_color.items():
                 pen.setColor(QtGui.QColor(r, g, b))
                 p.setPen(pen)
-                x, y = self.translate_original_to_resized(node.x, node.y)
-                p.drawPoint(x, y)
+                p.drawPoints(points)
+
+    @staticmethod
+    def simplify_lines(lines):
+        '''
+        Snap lines (array of x1, y1, x2, y2 rows) to whole pixels, drop duplicates
+        and lines shorter than a pixel
+        '''
+        lines = np.rint(lines)
+        lines = lines[(lines[:, 0] != lines[:, 2]) | (lines[:, 1] != lines[:, 3])]
+        # Same line both ways round is one line
+        flip = (lines[:, 0] > lines[:, 2]) | \
+            ((lines[:, 0] == lines[:, 2]) & (lines[:, 1] > lines[:, 3]))
+        lines[flip] = lines[flip][:, [2, 3, 0, 1]]
+        # Unique rows by one int per line, 16 bits per coordinate is plenty for a layer
+        packed = np.clip(lines, -(1 << 15), (1 << 15) - 1).astype(np.int64) + (1 << 15)
+        keys = packed[:, 0] << 48 | packed[:, 1] << 32 | packed[:, 2] << 16 | packed[:, 3]
+        _, first = np.unique(keys, return_index=True)
+        return lines[first]
+
+    @staticmethod
+    def point_pairs(lines):
+        '''
+        QPolygonF of line end points for QPainter.drawLines, filled straight from the
+        array instead of creating a QLineF per line
+        '''
+        points = np.ascontiguousarray(lines, dtype=np.float64).reshape(-1)
+        polygon = QtGui.QPolygonF(len(points) // 2)
+        buffer = polygon.data()
+        buffer.setsize(points.nbytes)
+        np.frombuffer(buffer, dtype=np.float64)[:] = points
+        return polygon
 
     def mousePressEvent(self, event):
+        if event.button() == QtCore.Qt.MiddleButton:
+            self.pan_start = event.pos()
+            return
+        # Route is not edited while path is being calculated
+        if self.worker is not None:
+            return
         if event.buttons() == QtCore.Qt.LeftButton:
             if self.mode == 'route_edit' and self.selected_node is None:
                 self.add_route_node()
@@ -299,7 +704,7 @@ class Canvas(QtWidgets.QLabel):
         self.update()
 
     def mouseDoubleClickEvent(self, event):
-        if not self.selected_node:
+        if not self.selected_node or self.worker is not None:
             return
         self.pairing_node = self.selected_node
         self.pairing_node.pairing = True
@@ -308,24 +713,41 @@ class Canvas(QtWidgets.QLabel):
     def mouseMoveEvent(self, event):
         if self.image is None:
             return
+        if event.buttons() == QtCore.Qt.MiddleButton and self.pan_start is not None:
+            delta = event.pos() - self.pan_start
+            self.pan_start = event.pos()
+            self.pan(delta.x(), delta.y())
+            return
         self.mousepos = self.translated_mousepos(event.pos().x(), event.pos().y())
         left_mb = event.buttons() == QtCore.Qt.LeftButton
 
         # Moving node
-        if left_mb and self.selected_node and self.mode == 'route_edit':
+        if left_mb and self.selected_node and self.mode == 'route_edit' \
+                and self.worker is None:
             self.selected_node.x, self.selected_node.y = self.mousepos
+            self.edges.update_node(self.selected_node)
+            self.node_grid.move(self.selected_node)
+            self.segment_grid.update_node(self.selected_node)
+            self.path_forest.node_moved(self.selected_node)
+            self.route_changed()
 
         # Mouse over canvas
         if not left_mb and self.mode in ['route_edit', 'pairing']:
-            self.selected_node = None
-            for node in self.route_nodes:
-                if self.selected_node is None and node.within_reach(self.mousepos):
-                    self.selected_node = node
+            # Reach is in screen pixels, the same at every zoom level. Zoomed in
+            # it is less than a pixel, so the unrounded position is used.
+            radius = RouteNode.reach_radius / max(self.view_scale())
+            pos = self.translated_mousepos(event.pos().x(), event.pos().y(), exact=True)
+            self.selected_node = self.node_grid.nearest(pos, radius)
 
         self.update()
 
+    def wheelEvent(self, event):
+        if self.image is None:
+            return
+        self.zoom_at(event.pos(), 1.25 ** (event.angleDelta().y() / 120))
+
     def contextMenuEvent(self, event):
-        if self.selected_node is None:
+        if self.selected_node is None or self.worker is not None:
             return
         menu = QtWidgets.QMenu(self)
         del_action = menu.addAction('Delete')
@@ -11,6 +11,15 @@ class ItemList(QtWidgets.QListWidget):
         assert target_obj is not None, 'TARGET OBJECT NONE @ ITEM_LIST.py'
         self.addItem(target_obj)
 
+    def new_targets(self, targets):
+        '''Add many targets with one re-sort and repaint'''
+        self.setUpdatesEnabled(False)
+        self.setSortingEnabled(False)
+        for target in targets:
+            self.addItem(target)
+        self.setSortingEnabled(True)
+        self.setUpdatesEnabled(True)
+
     def del_target(self, target):
         target_index = self.row(target)
         self.takeItem(target_index)
@@ -0,0 +1,120 @@
+# Standard
+import threading
+import time
+
+# 3rd party
+from PyQt5 import QtCore
+
+# Local
+from ..path_utils.contraction import ContractionHierarchy
+from ..path_utils.graph import Graph
+from ..path_utils.path_manager import PathManager
+
+
+class Worker(QtCore.QThread):
+    '''
+    Background job with progress reporting and cancelling. Progress is emitted at
+    most once every PROGRESS_INTERVAL seconds.
+    '''
+    PROGRESS_INTERVAL = 0.1
+
+    progress_signal = QtCore.pyqtSignal(str, int, int)
+
+    def __init__(self):
+        super().__init__()
+        self.cancel_event = threading.Event()
+        self.last_progress = 0
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def report(self, msg, done, total):
+        now = time.monotonic()
+        if now - self.last_progress < self.PROGRESS_INTERVAL and done < total:
+            return
+        self.last_progress = now
+        self.progress_signal.emit(msg, done, total)
+
+
+class PathWorker(Worker):
+    '''
+    Runs PathManager outside of the GUI thread. Builds a plain data Graph snapshot
+    of route nodes and their EdgeRegistry, which are not edited while the worker
+    runs. Start, end and targets are indexes in nodes, found routes are emitted as
+    index lists. Routes that can not
+    be solved (e.g. targets on separate pieces of route or no route within the
+    time limit) emit error_signal.
+    Hierarchy is attached here rather than in the GUI thread, checking it against
+    the graph takes a full pass over the graph. With paths_from answering from the
+    kept trees no snapshot is built at all, graph stays None and neither the
+    hierarchy nor the distance cache is used.
+    '''
+    route_signal = QtCore.pyqtSignal(float, object)
+    error_signal = QtCore.pyqtSignal(str)
+
+    def __init__(self, nodes, edges, start, end, targets, mode, budget=None, cache=None,
+                 paths_from=None, chain_graph=None, hierarchy=None, split_graph=None):
+        super().__init__()
+        self.nodes = nodes
+        self.edges = edges
+        self.graph = None
+        self.start_node = start
+        self.end_node = end
+        self.target_nodes = targets
+        self.mode = mode
+        self.budget = budget
+        self.cache = cache
+        self.paths_from = paths_from
+        self.chain_graph = chain_graph
+        self.hierarchy = hierarchy
+        self.split_graph = split_graph
+
+    def run(self):
+        if self.paths_from is None:
+            self.graph = Graph.from_route_nodes(self.nodes, self.edges)
+            # Segments split for targets since building the hierarchy are not edits
+            self.graph.attach_split_graph(self.split_graph)
+            self.graph.attach_hierarchy(self.hierarchy)
+            # Earlier snapshot's chains are reused if the route has not been edited
+            self.graph.attach_chains(self.chain_graph)
+        # Snapshot and its fingerprint are both a pass over the whole route, the
+        # kept trees answer without either
+        cache = self.cache if self.graph is not None else None
+        path_manager = PathManager(self.graph, self.start_node, self.end_node,
+                                   self.target_nodes, progress=self.report,
+                                   cancelled=self.cancel_event.is_set,
+                                   cache=cache, paths_from=self.paths_from)
+        try:
+            if self.mode == 'anytime':
+                # Every yielded route is shorter than the previous one
+                for distance, route in path_manager.anytime_shortest_path(self.budget):
+                    self.route_signal.emit(distance, route)
+                return
+
+            distance, route = path_manager.get_shortest_route(self.mode)
+        except (ValueError, TimeoutError) as err:
+            self.error_signal.emit(str(err))
+            return
+        if route:
+            self.route_signal.emit(distance, route)
+
+
+class HierarchyWorker(Worker):
+    '''
+    Builds a contraction hierarchy of a Graph snapshot of route nodes, emits it
+    when done. Nodes splitting segments for targets are left out of it.
+    '''
+    hierarchy_signal = QtCore.pyqtSignal(object)
+
+    def __init__(self, nodes, edges):
+        super().__init__()
+        self.nodes = nodes
+        self.edges = edges
+
+    def run(self):
+        graph = Graph.from_route_nodes(self.nodes, self.edges)
+        progress = lambda done, total: self.report('Building hierarchy..', done, total)
+        hierarchy = ContractionHierarchy.build(graph, progress=progress,
+                                               cancelled=self.cancel_event.is_set)
+        if hierarchy is not None:
+            self.hierarchy_signal.emit(hierarchy)
@@ -0,0 +1,16 @@
+# 3rd party
+from PyQt5.QtWidgets import QListWidgetItem
+
+
+class TargetNode(QListWidgetItem):
+    def __init__(self, num, text, mx, my, parent_node):
+        super().__init__()
+        self.num = num
+        self.text = text
+        self.draw_x = mx
+        self.draw_y = my
+        self.parent_node = parent_node
+        self.update_text()
+
+    def update_text(self):
+        self.setText(f'[{self.num}] {self.text}')
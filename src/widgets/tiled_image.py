@@ -0,0 +1,154 @@
+# Standard
+import json
+import math
+import os
+from collections import OrderedDict
+
+# 3rd party
+import numpy as np
+from PyQt5 import QtGui, QtCore
+
+# Images with more pixels than this are opened as tile pyramids
+TILED_MIN_PIXELS = 4096 * 4096
+TILE_SIZE = 256
+# Decoded tiles kept in memory, 256 KB each
+TILE_CACHE_SIZE = 512
+
+
+def pyramid_dir(img_path):
+    '''Pyramid is cached next to the image as <name>.tiles/'''
+    return f'{os.path.splitext(img_path)[0]}.tiles'
+
+
+def open_image(img_path):
+    '''
+    QPixmap for normal sized images, TiledImage for very large ones. Falls back to
+    QPixmap if the pyramid can not be written next to the image.
+    '''
+    size = QtGui.QImageReader(img_path).size()
+    if size.width() * size.height() > TILED_MIN_PIXELS:
+        try:
+            return TiledImage(img_path)
+        except OSError:
+            pass
+    return QtGui.QPixmap(img_path)
+
+
+def draw_image(p, target, image, source):
+    '''Draw source rect of a QPixmap or TiledImage into target rect'''
+    if isinstance(image, TiledImage):
+        image.draw(p, target, source)
+    else:
+        p.drawPixmap(target, image, source)
+
+
+class TiledImage:
+    '''
+    Very large image stored as a pyramid of raw ARGB32 levels, every level half the
+    size of the previous one. Levels are built once and saved next to the image,
+    later loads only memory map them. Drawing decodes just the tiles of the level
+    closest to the current scale that are visible.
+
+    width() and height() are the full resolution size like with QPixmap.
+    '''
+    def __init__(self, img_path):
+        self.path = pyramid_dir(img_path)
+        meta = self.load_meta(img_path)
+        if meta is None:
+            meta = self.build(img_path)
+        self.size = meta['size']
+        self.levels = [np.memmap(os.path.join(self.path, f'level_{i}.raw'),
+                                 dtype=np.uint8, mode='r', shape=(h, w, 4))
+                       for i, (w, h) in enumerate(meta['levels'])]
+        self.tiles = OrderedDict()
+
+    def width(self):
+        return self.size[0]
+
+    def height(self):
+        return self.size[1]
+
+    def load_meta(self, img_path):
+        '''Meta of the cached pyramid, None if missing or older than the image'''
+        try:
+            with open(os.path.join(self.path, 'meta.json'), 'r') as meta_file:
+                meta = json.load(meta_file)
+        except (OSError, ValueError):
+            return None
+        stat = os.stat(img_path)
+        if meta.get('source') != [stat.st_size, stat.st_mtime]:
+            return None
+        return meta
+
+    def build(self, img_path):
+        '''Decode the image once and write every level of the pyramid'''
+        os.makedirs(self.path, exist_ok=True)
+        image = QtGui.QImage(img_path).convertToFormat(QtGui.QImage.Format_ARGB32)
+        if image.isNull():
+            raise OSError(f'Could not read {img_path}')
+        levels = []
+        while True:
+            w, h = image.width(), image.height()
+            bits = image.constBits()
+            bits.setsize(image.byteCount())
+            rows = np.frombuffer(bits, dtype=np.uint8).reshape(h, image.bytesPerLine())
+            level = np.memmap(os.path.join(self.path, f'level_{len(levels)}.raw'),
+                              dtype=np.uint8, mode='w+', shape=(h, w, 4))
+            level[:] = rows[:, :w * 4].reshape(h, w, 4)
+            level.flush()
+            del level
+            levels.append((w, h))
+            if w <= TILE_SIZE and h <= TILE_SIZE:
+                break
+            image = image.scaled(max(w // 2, 1), max(h // 2, 1),
+                                 transformMode=QtCore.Qt.SmoothTransformation)
+
+        stat = os.stat(img_path)
+        meta = {
+            'source': [stat.st_size, stat.st_mtime],
+            'size': levels[0],
+            'levels': levels
+        }
+        # Meta is written last so a half built pyramid is never used
+        with open(os.path.join(self.path, 'meta.json'), 'w') as meta_file:
+            json.dump(meta, meta_file)
+        return meta
+
+    def tile(self, level, tx, ty):
+        '''Decoded tile as QPixmap, least recently used tiles are dropped'''
+        key = (level, tx, ty)
+        pixmap = self.tiles.get(key)
+        if pixmap is not None:
+            self.tiles.move_to_end(key)
+            return pixmap
+        y, x = ty * TILE_SIZE, tx * TILE_SIZE
+        data = np.ascontiguousarray(self.levels[level][y:y + TILE_SIZE, x:x + TILE_SIZE])
+        h, w = data.shape[:2]
+        image = QtGui.QImage(data.data, w, h, w * 4, QtGui.QImage.Format_ARGB32)
+        pixmap = QtGui.QPixmap.fromImage(image.copy())
+        self.tiles[key] = pixmap
+        if len(self.tiles) > TILE_CACHE_SIZE:
+            self.tiles.popitem(last=False)
+        return pixmap
+
+    def draw(self, p, target, source):
+        '''Draw source rect (full resolution QRectF) into target QRectF'''
+        sx = target.width() / source.width()
+        sy = target.height() / source.height()
+        # Coarsest level that still has at least one pixel per screen pixel
+        level = min(int(math.log2(1 / sx)) if sx < 1 else 0, len(self.levels) - 1)
+        lh, lw = self.levels[level].shape[:2]
+        fx, fy = self.size[0] / lw, self.size[1] / lh
+
+        tx1 = max(int(source.left() / fx) // TILE_SIZE, 0)
+        ty1 = max(int(source.top() / fy) // TILE_SIZE, 0)
+        tx2 = min(int(source.right() / fx) // TILE_SIZE, (lw - 1) // TILE_SIZE)
+        ty2 = min(int(source.bottom() / fy) // TILE_SIZE, (lh - 1) // TILE_SIZE)
+        for ty in range(ty1, ty2 + 1):
+            for tx in range(tx1, tx2 + 1):
+                pixmap = self.tile(level, tx, ty)
+                x = (tx * TILE_SIZE * fx - source.left()) * sx + target.left()
+                y = (ty * TILE_SIZE * fy - source.top()) * sy + target.top()
+                rect = QtCore.QRectF(x, y, pixmap.width() * fx * sx,
+                                     pixmap.height() * fy * sy)
+                p.drawPixmap(rect, pixmap, QtCore.QRectF(pixmap.rect()))
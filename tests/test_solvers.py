@@ -0,0 +1,364 @@
+'''
+Randomized checks of the solvers against plain brute force and dijkstra.
+Run with pytest from the repository root.
+'''
+# Standard
+import itertools
+import math
+import random
+
+# 3rd party
+import pytest
+
+# Local
+from src.node_file import RouteNode, EdgeRegistry
+from src.path_utils.chains import ChainGraph
+from src.path_utils.contraction import ContractionHierarchy
+from src.path_utils.distance_cache import CacheRoute, DistanceCache
+from src.path_utils.dynamic_paths import ShortestPathForest
+from src.path_utils.graph import Graph
+from src.path_utils.held_karp import held_karp
+from src.path_utils.path_manager import PathManager
+
+
+def route_length(order, distances):
+    return sum(distances[i][j] for i, j in zip(order[:-1], order[1:]))
+
+
+def random_route(rnd, size):
+    '''Coordinates and (i, j) connections of a connected random route'''
+    coords = [(rnd.uniform(0, 100), rnd.uniform(0, 100)) for _ in range(size)]
+    connections = {(rnd.randrange(i), i) for i in range(1, size)}
+    for _ in range(size // 3):
+        i, j = sorted(rnd.sample(range(size), 2))
+        connections.add((i, j))
+    return coords, sorted(connections)
+
+
+def split_segment(rnd, coords, connections):
+    '''Split a random connection with a new node like placing a target does'''
+    i, j = connections.pop(rnd.randrange(len(connections)))
+    lerp = rnd.uniform(0.1, 0.9)
+    (x1, y1), (x2, y2) = coords[i], coords[j]
+    coords.append((x1 + lerp * (x2 - x1), y1 + lerp * (y2 - y1)))
+    v = len(coords) - 1
+    connections += [(i, v), (v, j)]
+    return v
+
+
+def make_graph(coords, connections, splits=()):
+    return Graph(coords, [(i, j, math.dist(coords[i], coords[j])) for i, j in connections],
+                 splits)
+
+
+def assert_path(graph, path, f, t, distance):
+    '''path goes from f to t along connections of graph and is distance long'''
+    assert path[0] == f and path[-1] == t
+    length = 0
+    for a, b in zip(path[:-1], path[1:]):
+        length += min(w for w, n in graph.adjacency[a] if n == b)
+    assert length == pytest.approx(distance)
+
+
+def assert_same_paths(graph, reference, terminals):
+    '''graph.paths_from finds as short paths as dijkstra on reference'''
+    for f in terminals:
+        found = graph.paths_from(f, terminals)
+        expected = reference.paths_from(f, terminals)
+        for t in terminals:
+            distance, path = found[t]
+            assert distance == pytest.approx(expected[t][0])
+            assert_path(reference, path, f, t, distance)
+
+
+@pytest.mark.parametrize('seed', range(40))
+def test_held_karp_matches_brute_force(seed):
+    rnd = random.Random(seed)
+    size = rnd.randint(2, 9)
+    # Not symmetric, order of the targets matters both ways
+    distances = [[0 if i == j else rnd.uniform(1, 100) for j in range(size)]
+                 for i in range(size)]
+
+    distance, order = held_karp(distances)
+
+    end = size - 1
+    best = min(route_length((0, ) + middle + (end, ), distances)
+               for middle in itertools.permutations(range(1, end)))
+    assert distance == pytest.approx(best)
+    assert order[0] == 0 and order[-1] == end
+    assert sorted(order) == list(range(size))
+    assert route_length(order, distances) == pytest.approx(distance)
+
+
+def test_held_karp_unreachable_target():
+    distances = [[0, 1, math.inf, 5],
+                 [1, 0, math.inf, 1],
+                 [math.inf, math.inf, 0, math.inf],
+                 [5, 1, math.inf, 0]]
+    with pytest.raises(ValueError):
+        held_karp(distances)
+
+
+@pytest.mark.parametrize('seed', range(30))
+def test_point_to_point_searches_match_dijkstra(seed):
+    rnd = random.Random(seed)
+    coords, connections = random_route(rnd, rnd.randint(2, 60))
+    # A separate piece that can not be reached from the rest
+    coords += [(200, 200), (210, 200)]
+    connections.append((len(coords) - 2, len(coords) - 1))
+    graph = make_graph(coords, connections)
+
+    for _ in range(10):
+        f, t = rnd.sample(range(len(coords)), 2)
+        expected = graph.shortest_path(f, t, 'dijkstra')
+        settled = graph.counter.settled
+        graph.counter.settled = 0
+        for method in 'astar', 'bidirectional', 'bidirectional_astar':
+            queries = graph.counter.queries
+            distance, path = graph.shortest_path(f, t, method)
+            assert graph.counter.queries == queries + 1
+            if expected[1]:
+                assert distance == pytest.approx(expected[0])
+                assert_path(graph, path, f, t, distance)
+            else:
+                assert distance == math.inf and path == ()
+            # Straight line heuristic never makes A* settle more than dijkstra,
+            # bidirectional settles every node at most once in each direction
+            limit = settled if method == 'astar' else 2 * len(coords)
+            assert 1 <= graph.counter.settled <= limit
+            graph.counter.settled = 0
+
+
+@pytest.mark.parametrize('search', ['astar', 'bidirectional', 'bidirectional_astar'])
+def test_path_manager_search_methods(search):
+    rnd = random.Random(search)
+    coords, connections = random_route(rnd, 40)
+    terminals = rnd.sample(range(len(coords)), 6)
+    expected = PathManager(make_graph(coords, connections), terminals[0], terminals[-1],
+                           terminals[1:-1], processes=1)
+    found = PathManager(make_graph(coords, connections), terminals[0], terminals[-1],
+                        terminals[1:-1], processes=1, search=search)
+    distance, route = found.get_shortest_route('dijkstra')
+    assert distance == pytest.approx(expected.get_shortest_route('dijkstra')[0])
+    assert_path(found.graph, route, terminals[0], terminals[-1], distance)
+
+
+
+def test_path_manager_without_graph():
+    # Kept trees answer without a snapshot of the route
+    rnd = random.Random(0)
+    coords, connections = random_route(rnd, 40)
+    terminals = rnd.sample(range(len(coords)), 6)
+    graph = make_graph(coords, connections)
+    expected = PathManager(graph, terminals[0], terminals[-1], terminals[1:-1], processes=1)
+    found = PathManager(None, terminals[0], terminals[-1], terminals[1:-1], processes=1,
+                        paths_from=make_graph(coords, connections).paths_from)
+    distance, route = found.get_shortest_route('dijkstra')
+    assert distance == pytest.approx(expected.get_shortest_route('dijkstra')[0])
+    assert_path(graph, route, terminals[0], terminals[-1], distance)
+
+def test_hierarchy_search_needs_hierarchy():
+    graph = make_graph([(0, 0), (1, 0)], [(0, 1)])
+    with pytest.raises(ValueError):
+        graph.shortest_path(0, 1, 'hierarchy')
+
+
+@pytest.mark.parametrize('seed', range(30))
+def test_hierarchy_matches_dijkstra(seed):
+    rnd = random.Random(seed)
+    coords, connections = random_route(rnd, rnd.randint(2, 60))
+    graph = make_graph(coords, connections)
+    assert graph.attach_hierarchy(ContractionHierarchy.build(graph))
+
+    terminals = rnd.sample(range(len(coords)), min(6, len(coords)))
+    assert_same_paths(graph, make_graph(coords, connections), terminals)
+
+
+@pytest.mark.parametrize('seed', range(30))
+def test_split_hierarchy_matches_dijkstra(seed):
+    rnd = random.Random(seed)
+    coords, connections = random_route(rnd, rnd.randint(3, 40))
+    splits = [split_segment(rnd, coords, connections) for _ in range(rnd.randint(1, 4))]
+    hierarchy = ContractionHierarchy.build(make_graph(coords, connections, splits))
+    # Targets placed after building do not make the hierarchy out of date
+    added = [split_segment(rnd, coords, connections) for _ in range(rnd.randint(0, 4))]
+    graph = make_graph(coords, connections, splits + added)
+    assert graph.attach_hierarchy(hierarchy)
+
+    terminals = list(set(splits + added + rnd.sample(range(len(coords)), 3)))
+    assert_same_paths(graph, make_graph(coords, connections), terminals)
+
+    # Split graph of an earlier snapshot is reused while the route is the same
+    again = make_graph(coords, connections, splits + added)
+    assert again.attach_split_graph(graph.split_graph)
+    assert again.attach_hierarchy(hierarchy)
+    assert again.hierarchy is graph.split_graph
+
+
+def test_hierarchy_dropped_after_edit():
+    coords = [(0, 0), (10, 0), (10, 10)]
+    hierarchy = ContractionHierarchy.build(make_graph(coords, [(0, 1), (1, 2)]))
+    graph = make_graph(coords, [(0, 1), (1, 2), (0, 2)])
+    assert not graph.attach_hierarchy(hierarchy)
+    assert graph.paths_from(0, [2])[2] == (pytest.approx(math.hypot(10, 10)), (0, 2))
+
+
+def cache_paths(cache, graph, terminals):
+    route = CacheRoute(graph)
+    for f in terminals:
+        for t, (distance, path) in graph.paths_from(f, terminals).items():
+            cache.put(route, f, t, distance, path)
+
+
+def assert_cached_paths(cache, graph, terminals):
+    route = CacheRoute(graph)
+    for f in terminals:
+        expected = graph.paths_from(f, terminals)
+        for t in terminals:
+            distance, path = cache.get(route, f, t)
+            assert distance == pytest.approx(expected[t][0])
+            assert_path(graph, path, f, t, distance)
+
+
+@pytest.mark.parametrize('seed', range(30))
+def test_cache_kept_after_placing_target(seed, tmp_path):
+    rnd = random.Random(seed)
+    coords, connections = random_route(rnd, rnd.randint(3, 40))
+    splits = [split_segment(rnd, coords, connections) for _ in range(rnd.randint(0, 4))]
+    terminals = list(set(splits + rnd.sample(range(len(coords)), 3)))
+    cache = DistanceCache()
+    cache_paths(cache, make_graph(coords, connections, splits), terminals)
+
+    # Placing a target splits another segment, entries of the others still hit
+    splits += [split_segment(rnd, coords, connections) for _ in range(rnd.randint(1, 3))]
+    graph = make_graph(coords, connections, splits)
+    assert_cached_paths(cache, graph, terminals)
+    assert cache.misses == 0
+
+    cache.save(tmp_path / 'route.paths.json')
+    assert_cached_paths(DistanceCache.load(tmp_path / 'route.paths.json'), graph, terminals)
+
+
+def test_cache_save_is_capped(tmp_path, monkeypatch):
+    monkeypatch.setattr('src.path_utils.distance_cache.SAVED_PATH_NODES', 10)
+    coords = [(x, 0) for x in range(8)]
+    graph = make_graph(coords, [(x, x + 1) for x in range(7)])
+    cache = DistanceCache()
+    cache_paths(cache, graph, [0, 3, 7])
+    cache.save(tmp_path / 'route.paths.json')
+    saved = DistanceCache.load(tmp_path / 'route.paths.json')
+    # Most recently used paths that fit, in the same order
+    kept = list(cache.entries.items())[-len(saved.entries):]
+    assert 0 < len(saved.entries) < len(cache.entries)
+    assert list(saved.entries.items()) == kept
+    assert sum(len(path) for _, path in saved.entries.values()) <= 10
+
+
+class EditedRoute:
+    '''Route nodes edited the way Canvas does it, edits are told to forest'''
+    def __init__(self, coords, connections):
+        self.nodes = [RouteNode(x, y, (0, 0, 255)) for x, y in coords]
+        self.edges = EdgeRegistry()
+        self.forest = ShortestPathForest(self.neighbours)
+        for i, j in connections:
+            self.connect(self.nodes[i], self.nodes[j])
+
+    def neighbours(self, node):
+        return [(self.edges.length(node, c), c) for c in node.connects_with]
+
+    def connect(self, n1, n2):
+        n1.connects_with.append(n2)
+        n2.connects_with.append(n1)
+        self.edges.add(n1, n2)
+        self.forest.edge_changed(n1, n2)
+
+    def disconnect(self, n1, n2):
+        n1.connects_with.remove(n2)
+        n2.connects_with.remove(n1)
+        self.edges.remove(n1, n2)
+        self.forest.edge_changed(n1, n2)
+
+    def random_edit(self, rnd, keep):
+        '''Add, remove or split a connection, move or remove a node not in keep'''
+        edit = rnd.choice(['connect', 'disconnect', 'split', 'move', 'remove'])
+        pairs = list(self.edges)
+        if edit == 'connect':
+            n1, n2 = rnd.sample(self.nodes, 2)
+            if (n1, n2) not in self.edges:
+                self.connect(n1, n2)
+        elif edit == 'disconnect' and pairs:
+            self.disconnect(*rnd.choice(pairs))
+        elif edit == 'split' and pairs:
+            n1, n2 = rnd.choice(pairs)
+            lerp = rnd.uniform(0.1, 0.9)
+            node = RouteNode(n1.x + lerp * (n2.x - n1.x), n1.y + lerp * (n2.y - n1.y),
+                             (0, 0, 255))
+            self.nodes.append(node)
+            self.disconnect(n1, n2)
+            self.connect(n1, node)
+            self.connect(node, n2)
+        elif edit == 'move':
+            node = rnd.choice(self.nodes)
+            node.x, node.y = rnd.uniform(0, 100), rnd.uniform(0, 100)
+            self.edges.update_node(node)
+            self.forest.node_moved(node)
+        elif edit == 'remove':
+            removable = [node for node in self.nodes if node not in keep]
+            if removable:
+                node = rnd.choice(removable)
+                self.forest.node_removed(node)
+                self.edges.remove_node(node)
+                for c in node.connects_with:
+                    c.connects_with.remove(node)
+                node.connects_with = []
+                self.nodes.remove(node)
+
+
+@pytest.mark.parametrize('seed', range(40))
+def test_forest_repair_matches_fresh_search(seed):
+    rnd = random.Random(seed)
+    coords, connections = random_route(rnd, rnd.randint(5, 40))
+    route = EditedRoute(coords, connections)
+    terminals = rnd.sample(route.nodes, 4)
+    for t in terminals:
+        route.forest.paths_from(t, terminals)
+
+    for _ in range(5):
+        for _ in range(rnd.randint(1, 4)):
+            route.random_edit(rnd, terminals)
+        fresh = ShortestPathForest(route.neighbours)
+        for t in terminals:
+            repaired = route.forest.paths_from(t, route.nodes)
+            expected = fresh.paths_from(t, route.nodes)
+            for node, (distance, path), (fresh_distance, _) in zip(route.nodes, repaired,
+                                                                  expected):
+                assert distance == pytest.approx(fresh_distance)
+                if path:
+                    assert path[0] is t and path[-1] is node
+                    length = sum(route.edges.length(a, b) for a, b in zip(path[:-1], path[1:]))
+                    assert length == pytest.approx(distance)
+
+
+@pytest.mark.parametrize('seed', range(40))
+def test_chain_graph_matches_dijkstra(seed):
+    rnd = random.Random(seed)
+    coords, connections = random_route(rnd, rnd.randint(2, 30))
+    # Bends make the chains, terminals end up inside them too
+    bends = [split_segment(rnd, coords, connections) for _ in range(rnd.randint(0, 60))]
+    graph = make_graph(coords, connections)
+    chains = ChainGraph(graph)
+    assert len(chains) <= len(coords)
+
+    terminals = list(set(rnd.sample(bends, min(4, len(bends)))
+                         + rnd.sample(range(len(coords)), 2)))
+    assert_same_paths(chains, graph, terminals)
+
+
+def test_chain_graph_ring():
+    # Every node has degree 2, one of them is kept
+    coords = [(math.cos(a) * 10, math.sin(a) * 10)
+              for a in (2 * math.pi * k / 7 for k in range(7))]
+    graph = make_graph(coords, [(k, (k + 1) % 7) for k in range(7)])
+    chains = ChainGraph(graph)
+    assert len(chains) == 1
+    assert_same_paths(chains, graph, range(7))